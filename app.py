@@ -1,12 +1,11 @@
-import streamlit as st
-import pandas as pd
-import io
-import base64
 import time
-import tempfile
-from datetime import datetime
 
-from backend1_integration import chat_with_agents, build_index  # (logic unchanged)
+_app_started = time.perf_counter()
+
+import streamlit as st
+import html
+import uuid
+from datetime import datetime
 
 # ----------------------------------
 # Page configuration
@@ -435,27 +434,110 @@ html, body, [class*="css"] {
 """, unsafe_allow_html=True)
 
 # ----------------------------------
-# Helper Functions (unchanged)
+# Helper Functions
 # ----------------------------------
-def create_download_link(file_path, file_name):
+def get_parsed_upload(uploaded_file):
+    """Parse the CSV once per upload; reruns reuse the same object from session state"""
+    upload_id = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+    cached = st.session_state.get("parsed_upload")
+    if cached is None or cached[0] != upload_id:
+        from csv_ingest import parse_upload
+        cached = (upload_id, parse_upload(uploaded_file.getvalue()))
+        st.session_state.parsed_upload = cached
+    return cached[1]
+
+def get_pdf_extraction(pdf_file):
+    """Extract the PDF once per upload (in memory, no temp files); returns a pdf_extract.PdfExtraction or None"""
+    upload_id = getattr(pdf_file, "file_id", None) or (pdf_file.name, pdf_file.size)
+    cached = st.session_state.get("pdf_extraction")
+    if cached is not None and cached[0] == upload_id:
+        return cached[1]
     try:
-        with open(file_path, "rb") as f:
-            b64 = base64.b64encode(f.read()).decode()
-        return f'<a href="data:application/pdf;base64,{b64}" download="{file_name}">📥 Download Report PDF</a>'
-    except FileNotFoundError:
-        return "❌ File not found. Please try generating the report again."
-
-def extract_pdf_text(pdf_file):
-    try:
-        import fitz  # PyMuPDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(pdf_file.read())
-            path = tmp.name
-        doc = fitz.open(path)
-        return "\n".join([p.get_text() for p in doc])
+        from pdf_extract import extract_pdf
+        extraction = extract_pdf(pdf_file.getvalue())
     except Exception as e:
         st.error(f"Error reading PDF: {str(e)}")
         return None
+    st.session_state.pdf_extraction = (upload_id, extraction)
+    return extraction
+
+# How often a running job's progress is redrawn
+JOB_POLL_SECONDS = 0.5
+
+def session_id():
+    """ID of this browser tab, kept in the URL (?sid=...) while a job runs so a refresh stays the same subscriber"""
+    sid = st.session_state.get("session_id") or st.query_params.get("sid") or uuid.uuid4().hex[:12]
+    st.session_state.session_id = sid
+    return sid
+
+def cancel_analysis():
+    """Cancel button callback: leave the job (it stops before its next AI call once no tab follows it)"""
+    from jobs import job_queue
+    job_id = st.session_state.get("job_id")
+    if not job_id:
+        return
+    stopped = job_queue.cancel(job_id, session_id())
+    forget_job()
+    st.session_state.analysis_notice = (
+        "warning",
+        "⏹️ Analysis cancelled. No further AI calls were made." if stopped else "⏹️ Analysis cancelled.",
+    )
+
+def forget_job():
+    st.session_state.pop("job_id", None)
+    st.query_params.pop("job", None)
+    st.query_params.pop("sid", None)
+
+def active_job():
+    """
+    The job this browser tab started, looked up by the ID kept in session state and
+    in the URL (?job=...), so reruns and page refreshes reattach to it
+    """
+    from jobs import DONE, CANCELLED, job_queue
+    job_id = st.session_state.get("job_id") or st.query_params.get("job")
+    if not job_id:
+        return None
+    job = job_queue.get(job_id)
+    if job is None:
+        forget_job()
+        return None
+    st.session_state.job_id = job_id
+    if not job.is_finished:
+        job_queue.attach(job_id, session_id())
+        return job
+
+    # Finished: move the outcome into the session and stop tracking the job
+    forget_job()
+    if job.state == DONE:
+        st.session_state.analysis_result = job.result
+        st.session_state.pdf_bytes = job.pdf_bytes()
+        st.session_state.analysis_complete = True
+        st.session_state.file_type = job.file_type
+        # A shared (coalesced) job carries the first uploader's file name
+        st.session_state.uploaded_file_name = st.session_state.get("uploaded_file_name") or job.file_name
+    elif job.state == CANCELLED:
+        st.session_state.analysis_notice = ("warning", "⏹️ Analysis cancelled. No further AI calls were made.")
+    else:
+        st.session_state.analysis_notice = ("error", f"❌ Analysis failed: {job.error}")
+    return None
+
+def watch_job(job):
+    """
+    Draw the job's progress and streamed report until it finishes, then rerun to show
+    the result. Each poll is also this tab's heartbeat: a job no tab polls is cancelled.
+    """
+    from jobs import job_queue
+    progress_bar = st.progress(int(job.progress * 100))
+    status_text = st.empty()
+    live_output = st.empty()
+    st.button("⏹️ Cancel analysis", use_container_width=True, key="cancel_analysis", on_click=cancel_analysis)
+    while not job.is_finished:
+        job_queue.attach(job.id, session_id())
+        progress_bar.progress(int(job.progress * 100))
+        status_text.markdown(f"🤖 **{job.message}**")
+        live_output.markdown(job.text())
+        time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
 
 # ----------------------------------
 # Main Application
@@ -468,17 +550,50 @@ def main():
         <div class="header-subtitle">Your AI PowerBI Report Assistant</div>
     </div>
     """, unsafe_allow_html=True)
+    header_seconds = time.perf_counter() - _app_started
+
+    # ---- Backend (imported once the header is on screen; it defers its own heavy libraries) ----
+    from backend1_integration import import_times, index_status, initialize_system
+    from jobs import QueueFullError, job_queue
+    if not st.session_state.get("startup_logged"):
+        st.session_state.startup_logged = True
+        print(
+            f"🚀 Header sent {header_seconds:.2f}s after script start; "
+            f"backend import took {import_times().get('backend1_integration', 0.0):.2f}s"
+        )
 
     # ---- Session State Initialization ----
     for k, v in {
         'analysis_complete': False,
         'analysis_result': None,
-        'pdf_path': None,
+        'pdf_bytes': None,
         'file_type': None,
         'uploaded_file_name': None
     }.items():
         st.session_state.setdefault(k, v)
 
+    # ---- Knowledge Base Readiness (one shared index per server process) ----
+    initialize_system()
+    rag_status = index_status()
+    if rag_status["state"] in ("idle", "building"):
+        st.markdown("""
+        <div class="status-message status-message--info">
+            ⏳ <strong>Warming up the Power BI knowledge base...</strong> You can upload a file in the meantime.
+        </div>
+        """, unsafe_allow_html=True)
+    elif rag_status["state"] == "failed":
+        st.markdown(f"""
+        <div class="status-message status-message--error">
+            ❌ <strong>Knowledge base failed to load:</strong> {html.escape(str(rag_status['error']))}
+        </div>
+        """, unsafe_allow_html=True)
+
+    # ---- Reattach to a submitted analysis ----
+    job = active_job()
+    notice = st.session_state.pop("analysis_notice", None)
+    if notice:
+        getattr(st, notice[0])(notice[1])
+
     # ---- Analysis Type Selection ----
     st.markdown("""
     <div class="section-header fade-in-up">
@@ -552,8 +667,9 @@ def main():
             # ---- CSV Preview ----
             if st.session_state.file_type == "csv":
                 try:
-                    df = pd.read_csv(uploaded_file, encoding='latin-1')
-                    
+                    upload = get_parsed_upload(uploaded_file)
+                    df = upload.df
+
                     st.markdown("""
                     <div class="content-card fade-in-up">
                         <div class="card-title">👀 Dataset Preview</div>
@@ -562,12 +678,23 @@ def main():
                     
                     col1, col2, col3 = st.columns(3)
                     with col1:
-                        st.metric("📊 Total Rows", f"{df.shape[0]:,}")
+                        if upload.complete:
+                            st.metric("📊 Total Rows", f"{df.shape[0]:,}")
+                        else:
+                            st.metric("📊 Rows Previewed", f"{df.shape[0]:,}", help="Large file: rows are counted during analysis")
                     with col2:
                         st.metric("📋 Total Columns", f"{df.shape[1]:,}")
                     with col3:
-                        st.metric("💾 Memory Usage", f"{df.memory_usage(deep=True).sum() / 1024:.1f} KB")
+                        st.metric("💾 Memory Usage", f"{upload.read_report['memory_optimized_bytes'] / 1024:.1f} KB")
                     
+                    report = upload.read_report
+                    st.caption(
+                        f"Parsed with the {report['engine']} engine · encoding {report['encoding']} · "
+                        f"delimiter {report['delimiter']!r} · {report['parse_seconds']:.2f}s · "
+                        f"memory {report['memory_parsed_bytes'] / 1024:.1f} KB → "
+                        f"{report['memory_optimized_bytes'] / 1024:.1f} KB"
+                    )
+
                     st.markdown('<div class="dataframe-container">', unsafe_allow_html=True)
                     st.dataframe(df.head(10), use_container_width=True)
                     st.markdown('</div>', unsafe_allow_html=True)
@@ -575,7 +702,7 @@ def main():
                 except Exception as e:
                     st.markdown(f"""
                     <div class="status-message status-message--error">
-                        ❌ <strong>Error reading CSV file:</strong> {str(e)}
+                        ❌ <strong>Error reading CSV file:</strong> {html.escape(str(e))}
                     </div>
                     """, unsafe_allow_html=True)
 
@@ -584,73 +711,56 @@ def main():
             
             col1, col2, col3 = st.columns([1, 2, 1])
             with col2:
-                if st.button("🔍 Start AI Analysis", use_container_width=True, type="primary"):
-                    
-                    # Progress indicator
-                    progress_bar = st.progress(0)
-                    status_text = st.empty()
-                    
-                    try:
-                        # Step 1: Initialize
-                        status_text.markdown("🔧 **Initializing AI systems...**")
-                        progress_bar.progress(20)
-                        time.sleep(0.5)
-                        
-                        query_engine = build_index()
-                        
-                        # Step 2: Process file
-                        status_text.markdown("📄 **Processing your file...**")
-                        progress_bar.progress(40)
-                        time.sleep(0.5)
-                        
-                        if st.session_state.file_type == "csv":
-                            file_content = io.BytesIO(uploaded_file.getvalue())
-                        else:
-                            pdf_text = extract_pdf_text(uploaded_file)
-                            if pdf_text is None:
-                                st.error("Failed to extract text from PDF. Please try again.")
-                                st.stop()
-                            file_content = pdf_text
-
-                        # Step 3: AI Analysis
-                        status_text.markdown("🤖 **AI agents are analyzing your data...**")
-                        progress_bar.progress(60)
-                        time.sleep(0.5)
-
-                        result, pdf_path = chat_with_agents(
-                            file_type=st.session_state.file_type,
-                            file_content=file_content,
-                            query_engine=query_engine
+                if job is None and st.button("🔍 Start AI Analysis", use_container_width=True, type="primary"):
+                    if st.session_state.file_type == "csv":
+                        try:
+                            file_content = get_parsed_upload(uploaded_file)
+                        except Exception as e:
+                            st.markdown(f"""
+                            <div class="status-message status-message--error">
+                                ❌ <strong>Analysis failed: could not read the CSV file:</strong> {html.escape(str(e))}
+                            </div>
+                            """, unsafe_allow_html=True)
+                            st.stop()
+                    else:
+                        extraction = get_pdf_extraction(uploaded_file)
+                        if extraction is None:
+                            st.error("Failed to extract text from PDF. Please try again.")
+                            st.stop()
+                        report = extraction.report
+                        saved = 1 - report['prompt_chars'] / max(report['raw_chars'], 1)
+                        # Shown after the rerun below
+                        st.session_state.analysis_notice = (
+                            "caption",
+                            f"📄 **Extracted {report['pages']} pages in {report['seconds']:.2f}s** "
+                            f"({report['tables']} tables, {report['skipped_pages']} image-only skipped, {report['cached_pages']} from cache, "
+                            f"{report['workers']} worker(s)) · repeated boilerplate trimmed the prompt by {saved:.0%}",
                         )
+                        file_content = extraction
 
-                        # Step 4: Finalize
-                        status_text.markdown("📊 **Generating insights and reports...**")
-                        progress_bar.progress(90)
-                        time.sleep(0.5)
-                        
-                        st.session_state.analysis_result = result
-                        st.session_state.pdf_path = pdf_path
-                        st.session_state.analysis_complete = True
-                        
-                        progress_bar.progress(100)
-                        status_text.markdown("✅ **Analysis complete!**")
-                        time.sleep(1)
-                        
-                        # Clear progress indicators
-                        progress_bar.empty()
-                        status_text.empty()
-                        
+                    # The analysis runs on the server's worker pool; this page only follows it
+                    try:
+                        job = job_queue.submit(
+                            st.session_state.file_type, file_content,
+                            file_name=uploaded_file.name, session_id=session_id(),
+                        )
+                    except QueueFullError as e:
+                        st.warning(f"⏳ The server is busy: {e}")
+                    else:
+                        st.session_state.job_id = job.id
+                        st.query_params["job"] = job.id
+                        st.query_params["sid"] = session_id()
                         st.rerun()
 
-                    except Exception as e:
-                        progress_bar.empty()
-                        status_text.empty()
-                        
-                        st.markdown(f"""
-                        <div class="status-message status-message--error">
-                            ❌ <strong>Analysis failed:</strong> {str(e)}
-                        </div>
-                        """, unsafe_allow_html=True)
+    # ---- Analysis Progress (survives reruns and page refreshes) ----
+    if job is not None:
+        st.markdown(f"""
+        <div class="section-header fade-in-up">
+            <div class="section-title">⏳ Analysis in progress</div>
+            <div class="section-subtitle">{html.escape(st.session_state.get('uploaded_file_name') or job.file_name or 'Your file')} · you can refresh this page; the analysis keeps running</div>
+        </div>
+        """, unsafe_allow_html=True)
+        watch_job(job)
 
     # ---- Results Section ----
     if st.session_state.analysis_complete and st.session_state.analysis_result:
@@ -688,16 +798,15 @@ def main():
             """)
         
         with col2:
-            if st.session_state.pdf_path:
-                with open(st.session_state.pdf_path, "rb") as pdf_file:
-                    st.download_button(
-                        label="📥 Download Full Report (PDF)",
-                        data=pdf_file,
-                        file_name=f"insightpilot_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                        mime="application/pdf",
-                        use_container_width=True,
-                        type="primary"
-                    )
+            if st.session_state.pdf_bytes:
+                st.download_button(
+                    label="📥 Download Full Report (PDF)",
+                    data=st.session_state.pdf_bytes,
+                    file_name=f"insightpilot_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+                    mime="application/pdf",
+                    use_container_width=True,
+                    type="primary"
+                )
 
         # New Analysis Button
         st.markdown("<br><br>", unsafe_allow_html=True)
@@ -705,17 +814,18 @@ def main():
         with col2:
             if st.button("🔄 Start New Analysis", use_container_width=True, key="new_analysis"):
                 for key in [
-                    'analysis_complete', 'analysis_result', 'pdf_path',
-                    'file_type', 'uploaded_file_name'
+                    'analysis_complete', 'analysis_result', 'pdf_bytes',
+                    'file_type', 'uploaded_file_name', 'parsed_upload', 'pdf_extraction'
                 ]:
                     if key in st.session_state:
                         del st.session_state[key]
+                forget_job()
                 st.rerun()
 
     # ---- Footer ----
     st.markdown("""
     <div class="footer">
-        🚀 <span class="footer-brand">InsightPilot</span> • Powered by CrewAI & OpenAI
+        🚀 <span class="footer-brand">InsightPilot</span> • Powered by OpenAI & LlamaIndex
     </div>
     """, unsafe_allow_html=True)
 
@@ -1,21 +1,46 @@
 """
 Backend Integration Module for InsightPilot
 (Strictly Streamlit-compatible – no Gradio)
+
+Heavy dependencies (openai, llama_index, PyMuPDF, fpdf) and the OpenAI clients are
+loaded by the first stage that needs them, not at import, so the app paints at once.
 """
 
-from crewai import Agent, Task, Crew
-from textwrap import dedent
-from openai import OpenAI
+import time
+
+_import_started = time.perf_counter()
+
+import numpy as np
 import pandas as pd
-from fpdf import FPDF
 from datetime import datetime
 import re
 from pathlib import Path
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex
-from llama_index.embeddings.openai import OpenAIEmbedding
 from dotenv import load_dotenv
+import importlib
 import os
-import fitz  # PyMuPDF
+import asyncio
+import contextvars
+import math
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from csv_ingest import as_parsed_upload, clean_and_summarize_chunked, row_hashes
+from llm_cache import response_cache
+from metrics import metrics, span
+from profiling import SketchProfiler, format_profile, summarize_profile
+from token_budget import (
+    CHARS_PER_TOKEN,
+    MAX_PDF_TOKENS,
+    PromptBudgetError,
+    TokenLedger,
+    check_prompt,
+    count_tokens,
+    fit_sections,
+    ledger_scope,
+    record_call,
+)
 
 # ---------------------------
 # INIT
@@ -23,109 +48,422 @@ import fitz  # PyMuPDF
 load_dotenv(dotenv_path=Path('.') / '.env')
 print("✅ OpenAI Key Loaded:", bool(os.getenv("OPENAI_API_KEY")))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY is not set")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Created on first use by _openai_client() / _async_openai_client()
+client = None
+aclient = None
+_client_lock = threading.Lock()
+
+# First-import time of every lazily loaded dependency, in seconds
+_import_seconds = {}
+
+# Long PDF reports: above INSIGHT_SINGLE_PASS_TOKENS the text is split into chunks of
+# about INSIGHT_CHUNK_TOKENS, summarised by up to INSIGHT_MAP_WORKERS concurrent calls
+# and merged in one final call
+INSIGHT_SINGLE_PASS_TOKENS = int(os.getenv("INSIGHTPILOT_INSIGHT_SINGLE_PASS_TOKENS", "24000"))
+INSIGHT_CHUNK_TOKENS = int(os.getenv("INSIGHTPILOT_INSIGHT_CHUNK_TOKENS", "6000"))
+INSIGHT_MAP_WORKERS = int(os.getenv("INSIGHTPILOT_INSIGHT_MAP_WORKERS", "8"))
 
-# Global RAG objects
+# Chat model for dataset descriptions and PDF insights (part of the job coalescing key)
+ANALYSIS_MODEL = os.getenv("INSIGHTPILOT_ANALYSIS_MODEL", "gpt-4o")
+
+# Global RAG objects (one per process, shared by every Streamlit session)
 _index = None
 _query_engine = None
+_streaming_query_engine = None
+_index_lock = threading.Lock()
+_warmup_lock = threading.Lock()
+_warmup_thread = None
+_index_status = {"state": "idle", "error": None, "build_seconds": None, "corpus_version": None}
+
+
+def _lazy_import(name: str):
+    """Import a heavy module the first time a stage needs it, recording how long it took"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    elapsed = time.perf_counter() - started
+    _import_seconds.setdefault(name, elapsed)
+    metrics.observe(f"import:{name}", elapsed, status="ok")
+    print(f"📦 Loaded {name} in {elapsed:.2f}s")
+    return module
+
+
+def import_times() -> dict:
+    """Seconds spent importing this module and each dependency it loaded lazily"""
+    return dict(_import_seconds)
+
+
+def _require_api_key() -> str:
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY is not set")
+    return OPENAI_API_KEY
+
+
+def _openai_client():
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                api_key = _require_api_key()
+                client = _lazy_import("openai").OpenAI(api_key=api_key)
+    return client
+
+
+def _async_openai_client():
+    global aclient
+    if aclient is None:
+        with _client_lock:
+            if aclient is None:
+                api_key = _require_api_key()
+                aclient = _lazy_import("openai").AsyncOpenAI(api_key=api_key)
+    return aclient
+
+
+def build_index(streaming=False):
+    """
+    Return the process-wide RAG query engine, building it from ./data on first use.
+    Concurrent callers block on the same build instead of starting their own.
+    streaming=True returns a query engine over the same index that streams tokens.
+    """
+    global _index, _query_engine, _streaming_query_engine
 
+    with _index_lock:
+        if _query_engine is not None:
+            return _streaming_query_engine if streaming else _query_engine
 
-def build_index():
-    """Build the RAG index from PDFs in ./data"""
-    global _index, _query_engine
+        _index_status.update(state="building", error=None)
+        started = time.perf_counter()
+        try:
+            Path("data").mkdir(exist_ok=True)
+            rag_index = _lazy_import("rag_index")
+            api_key = _require_api_key()
+            embed_model = _lazy_import("llama_index.embeddings.openai").OpenAIEmbedding(api_key=api_key)
+            _index = rag_index.load_or_build_index(embed_model=embed_model)
+            _query_engine = _index.as_query_engine()
+            _streaming_query_engine = _index.as_query_engine(streaming=True)
+        except Exception as e:
+            _index_status.update(state="failed", error=str(e))
+            metrics.observe("index_build", time.perf_counter() - started, status="error")
+            raise
+
+        _index_status.update(
+            state="ready",
+            build_seconds=time.perf_counter() - started,
+            corpus_version=rag_index.read_corpus_version(),
+        )
+        metrics.observe("index_build", _index_status["build_seconds"], status="ok")
+        print("✅ RAG index is ready!")
+        return _streaming_query_engine if streaming else _query_engine
 
-    print("📂 Loading documents from ./data ...")
-    Path("data").mkdir(exist_ok=True)
-    documents = SimpleDirectoryReader("data").load_data()
-    print(f"✅ Loaded {len(documents)} documents. Creating vector index...")
 
-    _index = VectorStoreIndex.from_documents(
-        documents,
-        embed_model=OpenAIEmbedding()
-    )
-    _query_engine = _index.as_query_engine()
-    print("✅ RAG index is ready!")
-    return _query_engine
+def index_status() -> dict:
+    """Readiness of the shared RAG index: state is idle / building / ready / failed"""
+    return dict(_index_status)
+
+
+def _pipeline_gauges() -> dict:
+    llm = response_cache.stats()
+    # Only report the page cache once a PDF stage has loaded pdf_extract
+    pdf_extract = sys.modules.get("pdf_extract")
+    pages = pdf_extract.page_cache.stats() if pdf_extract else {}
+    return {
+        "llm_cache_hit_ratio": llm["hit_ratio"],
+        "llm_cache_entries": llm["entries"],
+        "llm_cache_bytes": llm["bytes"],
+        "pdf_page_cache_hit_ratio": pages.get("hit_ratio"),
+        "index_build_seconds": _index_status["build_seconds"],
+        "index_ready": float(_index_status["state"] == "ready"),
+    }
+
+
+metrics.register_gauges(_pipeline_gauges)
+
+
+def pipeline_metrics() -> dict:
+    """Stage latency summaries aggregated over this process's runs, plus cache/index gauges"""
+    return metrics.snapshot()
 
 
 # ---------------------------
-# Agents (labels only – real work is in functions)
+# Progress & cancellation
 # ---------------------------
-dataset_analyzer = Agent(
-    role="Dataset Analyzer",
-    goal="Understand and summarize any CSV dataset using GPT",
-    backstory="You clean and explain raw datasets in simple English.",
-    verbose=True
-)
+class AnalysisCancelled(Exception):
+    """Raised inside an analysis once its CancellationToken has been cancelled"""
 
-report_planner = Agent(
-    role="Dashboard Planner",
-    goal="Generate Power BI dashboard layout using real documentation",
-    backstory="You suggest layout, KPIs, DAX formulas using RAG.",
-    verbose=True
-)
 
-pdf_insight_agent = Agent(
-    role="PDF Insight Agent",
-    goal="Explain uploaded Power BI PDF dashboards",
-    backstory="You analyze charts and summarize insights clearly.",
-    verbose=True
-)
+class CancellationToken:
+    """
+    Flag shared between the caller and a running analysis. After cancel(), no new
+    LLM call starts, streamed answers stop being read (closing the connection) and
+    the analysis raises AnalysisCancelled at its next checkpoint.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise AnalysisCancelled("The analysis was cancelled.")
+
+
+_cancel_token = contextvars.ContextVar("insightpilot_cancel_token", default=None)
+
+
+@contextmanager
+def cancel_scope(token):
+    """Make every call in this context (and tasks/threads copying it) honour token"""
+    reset = _cancel_token.set(token)
+    try:
+        yield token
+    finally:
+        _cancel_token.reset(reset)
+
+
+def _check_cancelled():
+    token = _cancel_token.get()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def _progress(on_progress, fraction: float, message: str):
+    """Report progress (0..1) to on_progress, then stop here if the run was cancelled"""
+    if on_progress:
+        on_progress(min(max(fraction, 0.0), 1.0), message)
+    _check_cancelled()
+
+
+def _scaled(on_progress, start: float, end: float):
+    """on_progress for a sub-step that reports 0..1 within [start, end] of the whole run"""
+    if on_progress is None:
+        return None
+    return lambda fraction, message: on_progress(start + fraction * (end - start), message)
 
 
 # ---------------------------
 # Utilities
 # ---------------------------
+def _prepare_call(stage, model, messages, **params):
+    """
+    (prompt tokens, cache key, cached answer or None) for a chat call. Token
+    counting and the SQLite read block, so async callers run this in a thread.
+    """
+    prompt_tokens = check_prompt(stage, model, messages)
+    key = response_cache.make_key(model, messages, **params)
+    return prompt_tokens, key, response_cache.get(key)
+
+
+def chat_completion(messages, model="gpt-4o", stage="chat", **params) -> str:
+    """
+    Chat completion served from the on-disk response cache when possible.
+    The prompt is counted (and rejected if oversized) before any network call,
+    and the call is recorded in the current TokenLedger under stage.
+    """
+    prompt_tokens, key, cached = _prepare_call(stage, model, messages, **params)
+    if cached is not None:
+        record_call(stage, model, prompt_tokens, cached, cached=True)
+        return cached
+
+    _check_cancelled()
+    response = _openai_client().chat.completions.create(model=model, messages=messages, **params)
+    content = response.choices[0].message.content
+    response_cache.put(key, content)
+    record_call(stage, model, prompt_tokens, content)
+    return content
+
+
+def stream_chat_completion(messages, model="gpt-4o", stage="chat", **params):
+    """
+    Yield the completion text as it is generated. A cached answer is yielded in one
+    piece; a freshly streamed one is cached once the stream completes.
+    """
+    prompt_tokens, key, cached = _prepare_call(stage, model, messages, **params)
+    if cached is not None:
+        record_call(stage, model, prompt_tokens, cached, cached=True)
+        yield cached
+        return
+
+    _check_cancelled()
+    parts = []
+    stream = _openai_client().chat.completions.create(model=model, messages=messages, stream=True, **params)
+    try:
+        for chunk in stream:
+            _check_cancelled()
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    finally:
+        # Stops generation (and billing) when the consumer gives up early
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+    response_cache.put(key, "".join(parts))
+    record_call(stage, model, prompt_tokens, "".join(parts))
+
+
+def _complete(messages, model="gpt-4o", on_chunk=None, stage="chat") -> str:
+    """Return the full completion, forwarding deltas to on_chunk when streaming"""
+    if on_chunk is None:
+        return chat_completion(model=model, messages=messages, stage=stage)
+
+    parts = []
+    for delta in stream_chat_completion(model=model, messages=messages, stage=stage):
+        parts.append(delta)
+        on_chunk(delta)
+    return "".join(parts)
+
+
+async def achat_completion(messages, model="gpt-4o", stage="chat", **params) -> str:
+    """
+    Async twin of chat_completion() using the shared AsyncOpenAI client; token
+    counting and cache reads/writes run in threads so the event loop never blocks
+    """
+    prompt_tokens, key, cached = await asyncio.to_thread(_prepare_call, stage, model, messages, **params)
+    if cached is not None:
+        record_call(stage, model, prompt_tokens, cached, cached=True)
+        return cached
+
+    _check_cancelled()
+    response = await _async_openai_client().chat.completions.create(model=model, messages=messages, **params)
+    content = response.choices[0].message.content
+    await asyncio.to_thread(response_cache.put, key, content)
+    record_call(stage, model, prompt_tokens, content)
+    return content
+
+
 def extract_pdf_text(file_bytes: bytes) -> str:
-    """Extract text from PDF bytes"""
-    doc = fitz.open("pdf", file_bytes)
-    return "\n".join([page.get_text() for page in doc])
+    """Extract text from PDF bytes (pages separated by pdf_extract.PAGE_BREAK)"""
+    return _lazy_import("pdf_extract").extract_pdf(file_bytes).text
+
+
+def _text_units(text: str, max_chars: int):
+    """Pages of text (or lines, when there are no page breaks), none longer than max_chars"""
+    page_break = _lazy_import("pdf_extract").PAGE_BREAK
+    if page_break in text:
+        units = [page if page.endswith("\n") else page + "\n" for page in text.split(page_break)]
+    else:
+        units = text.splitlines(keepends=True)
+    for unit in units:
+        if len(unit) <= max_chars:
+            yield unit
+        elif page_break in unit or "\n" in unit.rstrip("\n"):
+            yield from _text_units(unit.replace(page_break, "\n"), max_chars)
+        else:
+            for start in range(0, len(unit), max_chars):
+                yield unit[start:start + max_chars]
+
+
+def split_report_text(text: str, max_tokens=INSIGHT_CHUNK_TOKENS, chars_per_token=CHARS_PER_TOKEN) -> list:
+    """
+    Pack whole pages (falling back to lines, then fixed-size slices) into chunks of
+    at most ~max_tokens, keeping the original order.
+    """
+    max_chars = max(1, int(max_tokens * chars_per_token))
+    chunks, current, size = [], [], 0
+    for unit in _text_units(text, max_chars):
+        if current and size + len(unit) > max_chars:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(unit)
+        size += len(unit)
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
 
 
 def clean_and_summarize(df: pd.DataFrame):
-    """Clean and prepare dataset for analysis and track what was done"""
+    """
+    Clean and prepare dataset for analysis and track what was done.
+    Columns to keep and duplicate rows (via one row-hash pass) are worked out
+    first and materialised with a single take, so df itself is never modified.
+    Per-step timings and row/column deltas are in df_clean.attrs["cleaning_steps"].
+    """
     original_shape = df.shape
     cleaning_report = []
+    steps = []
+
+    def _record(step, started, rows_removed=0, columns_removed=0):
+        steps.append({
+            "step": step,
+            "seconds": round(time.perf_counter() - started, 4),
+            "rows_removed": int(rows_removed),
+            "columns_removed": int(columns_removed),
+        })
 
     # Drop completely empty columns
-    empty_cols = df.columns[df.isna().all()].tolist()
+    started = time.perf_counter()
+    non_null = df.count().to_numpy()
+    empty_mask = non_null == 0
+    empty_cols = df.columns[empty_mask].tolist()
     if empty_cols:
         cleaning_report.append(f"Removed empty columns: {empty_cols}")
-    df.dropna(axis=1, how='all', inplace=True)
+    _record("drop_empty_columns", started, columns_removed=len(empty_cols))
 
     # Remove unnamed columns
-    unnamed_cols = df.columns[df.columns.str.contains('^Unnamed')].tolist()
+    started = time.perf_counter()
+    unnamed_mask = df.columns.str.contains('^Unnamed') & ~empty_mask
+    unnamed_cols = df.columns[unnamed_mask].tolist()
     if unnamed_cols:
         cleaning_report.append(f"Removed unnamed columns: {unnamed_cols}")
-    df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-
-    # Drop duplicates
-    before_dedup = len(df)
-    df.drop_duplicates(inplace=True)
-    after_dedup = len(df)
-    if before_dedup != after_dedup:
-        cleaning_report.append(f"Removed {before_dedup - after_dedup} duplicate rows")
-
-    # Strip column names
+    keep_cols = np.flatnonzero(~(empty_mask | unnamed_mask))
+    _record("drop_unnamed_columns", started, columns_removed=len(unnamed_cols))
+
+    # Drop duplicates (one 64-bit hash per row over the kept columns)
+    started = time.perf_counter()
+    duplicated = np.zeros(len(df), dtype=bool)
+    if len(keep_cols):
+        duplicated = pd.Series(row_hashes(df, keep_cols)).duplicated().to_numpy()
+    n_duplicates = int(duplicated.sum())
+    if n_duplicates:
+        cleaning_report.append(f"Removed {n_duplicates} duplicate rows")
+    _record("drop_duplicates", started, rows_removed=n_duplicates)
+
+    # Materialise once, then strip column names
+    started = time.perf_counter()
+    if n_duplicates or len(keep_cols) < df.shape[1]:
+        rows = np.flatnonzero(~duplicated) if n_duplicates else slice(None)
+        df = df.iloc[rows, keep_cols]
+    else:
+        df = df.copy(deep=False)
     df.columns = df.columns.str.strip()
-
-    if df.isnull().sum().sum() > 0:
+    _record("select_and_strip", started)
+
+    # Reuse the column counts from step 1; only re-count columns whose nulls
+    # might all have sat in the removed duplicate rows
+    started = time.perf_counter()
+    with_nulls = np.flatnonzero(non_null[keep_cols] < original_shape[0])
+    has_missing = len(with_nulls) > 0
+    if has_missing and n_duplicates:
+        has_missing = bool((df.iloc[:, with_nulls].count() < len(df)).any())
+    if has_missing:
         cleaning_report.append("Missing values detected in some columns.")
+    _record("detect_missing", started)
 
+    df.attrs["cleaning_steps"] = steps
     cleaning_report.append(f"Final dataset shape after cleaning: {df.shape} (original was {original_shape})")
     cleaning_report.append("Columns after cleaning: " + ", ".join(df.columns[:8]) + ("..." if len(df.columns) > 8 else ""))
     return df, "\n".join(cleaning_report)
 
 
-def describe_dataset(df: pd.DataFrame, cleaning_info: str) -> str:
-    """Generate dataset description using GPT"""
+def _dataset_messages(df: pd.DataFrame, cleaning_info: str, profile_text=None):
+    """Chat messages asking GPT to describe a cleaned dataset"""
     schema = df.dtypes.astype(str).to_dict()
     sample_rows = df.head(3).to_dict(orient="records")
+    if profile_text is None:
+        with span("profile"):
+            profile_text = summarize_profile(df)
 
-    prompt = f"""
+    template = """
 You are an intelligent assistant. A user uploaded a CSV file. Here is its info:
 
 🧹 Cleaning done:
@@ -137,6 +475,9 @@ You are an intelligent assistant. A user uploaded a CSV file. Here is its info:
 📊 Sample rows:
 {sample_rows}
 
+📈 Column profile (null rate, distinct values, ranges, most frequent values):
+{profile_text}
+
 Answer in plain business language:
 1. What is this dataset about (without guessing fields that don't exist)?
 2. Who might use this dataset?
@@ -146,22 +487,57 @@ Answer in plain business language:
 
 Be concise, non-technical, and avoid assumptions beyond the visible columns.
 """
-    response = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a helpful data understanding assistant."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    return response.choices[0].message.content
+    # Wide or verbose datasets are compacted to the stage budget (see token_budget.py)
+    prompt = fit_sections(template, {
+        "cleaning_info": cleaning_info,
+        "schema": str(schema),
+        "sample_rows": str(sample_rows),
+        "profile_text": profile_text,
+    }, stage="describe_dataset")
+    return [
+        {"role": "system", "content": "You are a helpful data understanding assistant."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def describe_dataset(df: pd.DataFrame, cleaning_info: str, on_chunk=None, profile_text=None) -> str:
+    """
+    Generate dataset description using GPT (streamed to on_chunk if given).
+    profile_text defaults to a column profile of df (see profiling.py).
+    """
+    messages = _dataset_messages(df, cleaning_info, profile_text)
+    with span("describe_dataset"):
+        return _complete(messages, model=ANALYSIS_MODEL, on_chunk=on_chunk, stage="describe_dataset")
+
+
+async def adescribe_dataset(df: pd.DataFrame, cleaning_info: str, profile_text=None) -> str:
+    """Async version of describe_dataset()"""
+    messages = await asyncio.to_thread(_dataset_messages, df, cleaning_info, profile_text)
+    with span("describe_dataset"):
+        return await achat_completion(model=ANALYSIS_MODEL, messages=messages, stage="describe_dataset")
 
 
 class ReportGeneratorAgent:
-    def __init__(self, query_engine):
+    DESIGN_BEST_PRACTICES = """
+📌 **Design Best Practices (from Visual Guide):**
+
+- Use high contrast between text and background
+- Avoid 3D visuals and excessive effects
+- Start Y-axis at 0 when appropriate
+- Keep colors consistent across visuals
+- Limit relationships per visual
+- Group related visuals with whitespace
+- Use sans-serif fonts (no italics/all-caps)
+- Test report comprehension with peers
+"""
+
+    def __init__(self, query_engine, corpus_version=None):
         self.query_engine = query_engine
+        # RAG answers depend on the indexed guidance, so the cache key includes its version
+        self.corpus_version = corpus_version or _index_status["corpus_version"]
 
-    def generate_report_plan(self, dataset_summary: str, cleaning_info: str):
-        prompt = f"""Additional Context:
+    def _build_prompt(self, dataset_summary: str, cleaning_info: str) -> str:
+        template = """Additional Context:
 
 - Assume the user is working in Power BI Desktop
 - Provide guidance on building a clean star schema
@@ -189,35 +565,134 @@ Using ONLY the uploaded Power BI guidance documents, design a Power BI dashboard
 
 Be concrete and structured.
 """
-        rag_response = str(self.query_engine.query(prompt))
-
-        design_best_practices = """
-📌 **Design Best Practices (from Visual Guide):**
-
-- Use high contrast between text and background
-- Avoid 3D visuals and excessive effects
-- Start Y-axis at 0 when appropriate
-- Keep colors consistent across visuals
-- Limit relationships per visual
-- Group related visuals with whitespace
-- Use sans-serif fonts (no italics/all-caps)
-- Test report comprehension with peers
-"""
-
-        return rag_response + "\n\n" + design_best_practices
+        return fit_sections(template, {"cleaning_info": cleaning_info, "dataset_summary": dataset_summary},
+                            stage="report_plan")
 
+    @property
+    def model_name(self) -> str:
+        """Model behind the query engine, for the token ledger"""
+        try:
+            return self.query_engine._response_synthesizer._llm.metadata.model_name
+        except AttributeError:
+            return "rag-query-engine"
+
+    def _record(self, prompt: str, answer: str, response=None, cached=False):
+        """Ledger entry for one RAG answer; retrieved context counts toward the prompt"""
+        context = "".join(node.get_content() for node in getattr(response, "source_nodes", None) or [])
+        model = self.model_name
+        record_call("report_plan", model, count_tokens(prompt, model) + count_tokens(context, model),
+                    answer, cached=cached)
+
+    def _retrieve(self, prompt: str):
+        """(query bundle, nodes), or (prompt, None) for engines that only offer query()"""
+        if hasattr(self.query_engine, "retrieve") and hasattr(self.query_engine, "synthesize"):
+            bundle = _lazy_import("llama_index.core").QueryBundle(prompt)
+            return bundle, self.query_engine.retrieve(bundle)
+        return prompt, None
+
+    async def _aretrieve(self, prompt: str):
+        if hasattr(self.query_engine, "aretrieve") and hasattr(self.query_engine, "asynthesize"):
+            bundle = _lazy_import("llama_index.core").QueryBundle(prompt)
+            return bundle, await self.query_engine.aretrieve(bundle)
+        return prompt, None
+
+    def _cached_answer(self, prompt: str):
+        """Return (cache_key, cached RAG answer or None)"""
+        if not self.corpus_version:
+            return None, None
+        cache_key = response_cache.make_key("rag-query-engine", [prompt], corpus=self.corpus_version)
+        return cache_key, response_cache.get(cache_key)
+
+    def generate_report_plan(self, dataset_summary: str, cleaning_info: str, on_chunk=None):
+        """
+        RAG-grounded dashboard plan. With on_chunk, tokens are forwarded as they
+        arrive when the query engine streams (build_index(streaming=True)).
+        """
+        prompt = self._build_prompt(dataset_summary, cleaning_info)
+        check_prompt("report_plan", self.model_name, [{"role": "user", "content": prompt}])
+        cache_key, rag_response = self._cached_answer(prompt)
+        if rag_response is None:
+            # Retrieval and generation are timed apart; a streamed answer counts
+            # toward generation until its last token
+            _check_cancelled()
+            with span("rag_retrieval"):
+                query, nodes = self._retrieve(prompt)
+            _check_cancelled()
+            with span("rag_generation"):
+                if nodes is None:
+                    response = self.query_engine.query(query)
+                else:
+                    response = self.query_engine.synthesize(query, nodes)
+                if hasattr(response, "response_gen"):
+                    parts = []
+                    for token in response.response_gen:
+                        _check_cancelled()
+                        parts.append(token)
+                        if on_chunk:
+                            on_chunk(token)
+                    rag_response = "".join(parts)
+                else:
+                    rag_response = str(response)
+                    if on_chunk:
+                        on_chunk(rag_response)
+            if cache_key:
+                response_cache.put(cache_key, rag_response)
+            self._record(prompt, rag_response, response)
+        else:
+            self._record(prompt, rag_response, cached=True)
+            if on_chunk:
+                on_chunk(rag_response)
+
+        tail = "\n\n" + self.DESIGN_BEST_PRACTICES
+        if on_chunk:
+            on_chunk(tail)
+        return rag_response + tail
+
+    async def agenerate_report_plan(self, dataset_summary: str, cleaning_info: str):
+        """Async version of generate_report_plan() using the query engine's async API"""
+        prompt = self._build_prompt(dataset_summary, cleaning_info)
+        await asyncio.to_thread(check_prompt, "report_plan", self.model_name, [{"role": "user", "content": prompt}])
+        cache_key, rag_response = await asyncio.to_thread(self._cached_answer, prompt)
+        if rag_response is None:
+            _check_cancelled()
+            with span("rag_retrieval"):
+                query, nodes = await self._aretrieve(prompt)
+            _check_cancelled()
+            with span("rag_generation"):
+                if nodes is None:
+                    response = await self.query_engine.aquery(query)
+                else:
+                    response = await self.query_engine.asynthesize(query, nodes)
+                rag_response = str(response)
+            if cache_key:
+                await asyncio.to_thread(response_cache.put, cache_key, rag_response)
+            self._record(prompt, rag_response, response)
+        else:
+            self._record(prompt, rag_response, cached=True)
 
+        return rag_response + "\n\n" + self.DESIGN_BEST_PRACTICES
 
 
 class InsightAgent:
-    def __init__(self, model="gpt-4o"):
+    """
+    Section-wise insights for a Power BI PDF. Reports that fit in
+    single_pass_tokens go to the model in one call; longer ones are map-reduced:
+    page-aligned chunks are summarised concurrently (at most map_workers at a time)
+    and the notes are merged into the usual section structure by a final call.
+    """
+
+    def __init__(self, model="gpt-4o", single_pass_tokens=INSIGHT_SINGLE_PASS_TOKENS,
+                 chunk_tokens=INSIGHT_CHUNK_TOKENS, map_workers=INSIGHT_MAP_WORKERS):
         self.model = model
+        self.single_pass_tokens = single_pass_tokens
+        self.chunk_tokens = chunk_tokens
+        self.map_workers = max(1, map_workers)
 
-    def generate_insights(self, raw_text: str) -> str:
+    def _build_messages(self, raw_text: str, intro="Below is the extracted text from a Power BI report:"):
         prompt = f"""
 You are a professional AI insight assistant for business intelligence dashboards.
 
-Below is the extracted text from a Power BI report:
+{intro}
 -------------------
 {raw_text}
 -------------------
@@ -234,22 +709,155 @@ Provide a **detailed, section-wise summary** with this structure:
 
 Be clear, concise, and avoid repeating table headers.
 """
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": "You are a helpful data analyst."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        return response.choices[0].message.content
+        return [
+            {"role": "system", "content": "You are a helpful data analyst."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _map_messages(self, chunk: str, part: int, total: int):
+        prompt = f"""
+You are reading part {part} of {total} of the extracted text of a Power BI report.
+-------------------
+{chunk}
+-------------------
+
+Extract every concrete finding in this part as short bullet points under these headings
+(leave out headings with nothing relevant):
+Revenue / Finance Trends; Customer Contributions; Product / Service Performance;
+Transaction or Operational Issues; City / Channel / Department Level Observations.
+
+Keep numbers, names, dates and periods exactly as written. Do not add recommendations.
+"""
+        return [
+            {"role": "system", "content": "You are a helpful data analyst."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _merge_intro(self, total: int) -> str:
+        return f"Below are notes taken from each of the {total} parts of a long Power BI report:"
+
+    def _split(self, raw_text: str) -> list:
+        """
+        Chunks for the map step. The chunk size grows (up to single_pass_tokens) so
+        that all chunks fit in one wave of map_workers calls, which keeps latency
+        close to one chunk plus the merge.
+        """
+        tokens = max(count_tokens(raw_text, self.model), 1)
+        # +10% headroom: whole pages never pack chunks completely full
+        wave_tokens = math.ceil(1.1 * tokens / self.map_workers)
+        budget = min(max(self.chunk_tokens, wave_tokens), self.single_pass_tokens)
+        return split_report_text(raw_text, max_tokens=budget, chars_per_token=len(raw_text) / tokens)
+
+    @staticmethod
+    def _join_notes(notes: list) -> str:
+        total = len(notes)
+        return "\n\n".join(f"[Part {i} of {total}]\n{note.strip()}" for i, note in enumerate(notes, 1))
+
+    def _map(self, raw_text: str, on_progress=None):
+        """
+        Summarise the chunks of raw_text concurrently; returns (notes_text, chunk_count).
+        Progress is reported from this thread as chunks finish; if it raises (e.g.
+        on cancellation) chunks that have not started yet are dropped.
+        """
+        chunks = self._split(raw_text)
+        started = time.perf_counter()
+
+        def _summarise(chunk, part):
+            return chat_completion(model=self.model, messages=self._map_messages(chunk, part, len(chunks)),
+                                   stage="insights_map")
+
+        # Each worker runs in a copy of this context so calls land in the caller's
+        # TokenLedger and see its CancellationToken
+        pool = ThreadPoolExecutor(max_workers=min(self.map_workers, len(chunks)), thread_name_prefix="insight-map")
+        try:
+            futures = {pool.submit(contextvars.copy_context().run, _summarise, chunk, i): i - 1
+                       for i, chunk in enumerate(chunks, 1)}
+            notes = [None] * len(chunks)
+            for done, future in enumerate(as_completed(futures), 1):
+                notes[futures[future]] = future.result()
+                _progress(on_progress, done / len(chunks), f"Summarised {done} of {len(chunks)} report parts")
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        elapsed = time.perf_counter() - started
+        metrics.observe("insights_map", elapsed, status="ok", chunks=len(chunks))
+        print(f"🧩 Summarised {len(chunks)} report chunks in {elapsed:.1f}s")
+        return self._join_notes(notes), len(chunks)
+
+    async def _amap(self, raw_text: str, on_progress=None):
+        # Tokenising the whole report is CPU-bound; keep it off the event loop
+        chunks = await asyncio.to_thread(self._split, raw_text)
+        started = time.perf_counter()
+        limit = asyncio.Semaphore(self.map_workers)
+        done = 0
+
+        async def _summarise(chunk, part):
+            nonlocal done
+            async with limit:
+                note = await achat_completion(model=self.model, messages=self._map_messages(chunk, part, len(chunks)),
+                                              stage="insights_map")
+            done += 1
+            _progress(on_progress, done / len(chunks), f"Summarised {done} of {len(chunks)} report parts")
+            return note
+
+        notes = await asyncio.gather(*(_summarise(chunk, i) for i, chunk in enumerate(chunks, 1)))
+        elapsed = time.perf_counter() - started
+        metrics.observe("insights_map", elapsed, status="ok", chunks=len(chunks))
+        print(f"🧩 Summarised {len(chunks)} report chunks in {elapsed:.1f}s")
+        return self._join_notes(notes), len(chunks)
+
+    def _needs_map(self, raw_text: str) -> bool:
+        """False if raw_text fits one call; raises PromptBudgetError above MAX_PDF_TOKENS"""
+        tokens = count_tokens(raw_text, self.model)
+        if tokens > MAX_PDF_TOKENS:
+            raise PromptBudgetError(
+                f"This PDF has about {tokens:,} tokens of text, over the {MAX_PDF_TOKENS:,} token limit. "
+                "Please upload a shorter report."
+            )
+        return tokens > self.single_pass_tokens
+
+    def generate_insights(self, raw_text: str, on_chunk=None, on_progress=None) -> str:
+        """on_progress(fraction, message) follows the map step of long reports"""
+        if not self._needs_map(raw_text):
+            with span("insights"):
+                return _complete(self._build_messages(raw_text), model=self.model, on_chunk=on_chunk, stage="insights")
+
+        # Notes of a very long report can themselves be too long; map them again
+        notes, parts = self._map(raw_text, _scaled(on_progress, 0.0, 0.8))
+        while count_tokens(notes, self.model) > self.single_pass_tokens and parts > 1:
+            notes, parts = self._map(notes, _scaled(on_progress, 0.8, 0.85))
+        _progress(on_progress, 0.85, "Merging insights from all report parts")
+        with span("insights_merge"):
+            return _complete(self._build_messages(notes, intro=self._merge_intro(parts)),
+                             model=self.model, on_chunk=on_chunk, stage="insights_merge")
+
+    async def agenerate_insights(self, raw_text: str, on_progress=None) -> str:
+        """Async version of generate_insights()"""
+        if not await asyncio.to_thread(self._needs_map, raw_text):
+            with span("insights"):
+                return await achat_completion(model=self.model, messages=self._build_messages(raw_text),
+                                              stage="insights")
+
+        notes, parts = await self._amap(raw_text, _scaled(on_progress, 0.0, 0.8))
+        while await asyncio.to_thread(count_tokens, notes, self.model) > self.single_pass_tokens and parts > 1:
+            notes, parts = await self._amap(notes, _scaled(on_progress, 0.8, 0.85))
+        _progress(on_progress, 0.85, "Merging insights from all report parts")
+        with span("insights_merge"):
+            return await achat_completion(model=self.model,
+                                          messages=self._build_messages(notes, intro=self._merge_intro(parts)),
+                                          stage="insights_merge")
 
 
 class ExportAgent:
+    """
+    Renders a report as PDF bytes in memory (to_pdf_bytes), so concurrent analyses
+    never share a file; save_as_pdf() still writes output_filename when a file is wanted.
+    """
+
     def __init__(self, output_filename="insight_report.pdf"):
         self.output_filename = output_filename
 
-    def save_as_pdf(self, insights_text: str):
-        pdf = FPDF()
+    def to_pdf_bytes(self, insights_text: str) -> bytes:
+        pdf = _lazy_import("fpdf").FPDF()
         pdf.add_page()
         pdf.set_font("Arial", size=12)
         pdf.set_title("InsightPilot Analysis Report")
@@ -271,82 +879,236 @@ class ExportAgent:
         pdf.set_font("Arial", '', 12)
         pdf.multi_cell(0, 8, cleaned_insights_text)
 
-        pdf.output(self.output_filename)
+        # fpdf returns a latin-1 str, fpdf2 a bytearray
+        data = pdf.output(dest="S")
+        return data.encode("latin-1") if isinstance(data, str) else bytes(data)
+
+    def save_as_pdf(self, insights_text: str):
+        Path(self.output_filename).write_bytes(self.to_pdf_bytes(insights_text))
         return self.output_filename
 
 
 # ---------------------------
-# Public entry point (used by Streamlit)
+# Public entry points (used by Streamlit)
 # ---------------------------
-def chat_with_agents(file_type, file_content, query_engine=None):
+def _section_header(title: str) -> str:
+    return (
+        "========================\n"
+        f"{title}\n"
+        "========================\n"
+    )
+
+
+def _load_and_clean_csv(file_content):
+    """
+    Clean the (parse-once) upload in memory, or chunk by chunk when it is too large.
+    Returns (df, cleaning_info, profile_text); profile_text is None when df is the
+    whole dataset, otherwise a sketch profile gathered while streaming.
+    """
+    upload = as_parsed_upload(file_content)
+    if upload.complete:
+        with span("clean"):
+            df_clean, cleaning_info = clean_and_summarize(upload.df)
+        return df_clean, cleaning_info, None
+
+    # Chunked cleaning re-reads the file and profiles it in the same pass
+    profiler = SketchProfiler()
+    with span("clean_chunked"):
+        df_preview, cleaning_info = clean_and_summarize_chunked(
+            upload.source(), encoding=upload.encoding, sep=upload.delimiter, profiler=profiler
+        )
+    return df_preview, cleaning_info, format_profile(profiler.profiles())
+
+
+def _compose_csv_report(cleaning_info: str, dataset_summary: str, dashboard_plan: str) -> str:
+    return (
+        _section_header("🧹 DATA CLEANING LOG") + f"{cleaning_info}\n\n"
+        + _section_header("📊 DATASET UNDERSTANDING") + f"{dataset_summary}\n\n"
+        + _section_header("📈 POWER BI DASHBOARD PLAN (RAG-GROUNDED)") + f"{dashboard_plan}"
+    )
+
+
+def _pdf_text_from(file_content) -> str:
+    """Prompt text for a PDF: boilerplate lines repeated across pages are stripped"""
+    pdf_extract = _lazy_import("pdf_extract")
+    if isinstance(file_content, (bytes, bytearray)):
+        file_content = pdf_extract.extract_pdf(file_content)
+    if isinstance(file_content, pdf_extract.PdfExtraction):
+        report = file_content.report
+        saved = count_tokens(file_content.text) - count_tokens(file_content.prompt_text)
+        print(
+            f"✂️ PDF prompt: {report['boilerplate_lines_removed']} boilerplate lines removed, "
+            f"~{saved:,} tokens saved; {report['cached_pages']}/{report['pages']} pages from cache"
+        )
+        return file_content.prompt_text
+    # If the caller already extracted text (not recommended), accept it
+    return str(file_content)
+
+
+def _ledger_section(ledger: TokenLedger) -> str:
+    return "\n\n" + _section_header("🧾 TOKEN USAGE & ESTIMATED COST") + ledger.summary()
+
+
+def chat_with_agents(file_type, file_content, query_engine=None, on_chunk=None, ledger=None,
+                     on_progress=None, cancel_token=None):
     """
     file_type: "csv" or "pdf"
     file_content:
-        - csv: BytesIO or bytes
-        - pdf: bytes (raw file bytes)
-    query_engine: result of build_index()
+        - csv: BytesIO, bytes or a csv_ingest.ParsedUpload
+        - pdf: bytes (raw file bytes) or a pdf_extract.PdfExtraction
+    query_engine: result of build_index() (build_index(streaming=True) when streaming)
+    on_chunk: optional callable receiving the report text incrementally; the chunks
+        concatenate to the returned text, and the PDF is built once they are done
+    ledger: optional TokenLedger to record every model call in; its summary is
+        appended to the report either way
+    on_progress: optional callable(fraction, message) called as stages start and
+        finish (fraction goes from 0 to 1)
+    cancel_token: optional CancellationToken; once cancelled no further model call
+        is made and AnalysisCancelled is raised
+    Returns (report_text, pdf_bytes); the PDF is built in memory, never on disk.
     """
+    emit = on_chunk or (lambda text: None)
+    ledger = ledger if ledger is not None else TokenLedger()
+
     if query_engine is None:
         raise ValueError("query_engine is None. Call build_index() first in your Streamlit app.")
 
-    if file_type == "csv":
-        # 1) Clean
-        try:
-            df = pd.read_csv(file_content, encoding='utf-8')
-        except UnicodeDecodeError:
-            df = pd.read_csv(file_content, encoding='latin-1')
-
-        df_clean, cleaning_info = clean_and_summarize(df)
-
-        # 2) Describe
-        dataset_summary = describe_dataset(df_clean, cleaning_info)
-
-        # 3) Plan dashboard (RAG)
-        planner = ReportGeneratorAgent(query_engine)
-        dashboard_plan = planner.generate_report_plan(dataset_summary,cleaning_info)
-
-        # 4) Combine
-        final_text = (
-            "========================\n"
-            "🧹 DATA CLEANING LOG\n"
-            "========================\n"
-            f"{cleaning_info}\n\n"
-            "========================\n"
-            "📊 DATASET UNDERSTANDING\n"
-            "========================\n"
-            f"{dataset_summary}\n\n"
-            "========================\n"
-            "📈 POWER BI DASHBOARD PLAN (RAG-GROUNDED)\n"
-            "========================\n"
-            f"{dashboard_plan}"
-        )
+    with ledger_scope(ledger), cancel_scope(cancel_token), metrics.run("analysis", file_type=file_type):
+        if file_type == "csv":
+            # 1) Clean
+            _progress(on_progress, 0.05, "Cleaning data...")
+            df_clean, cleaning_info, profile_text = _load_and_clean_csv(file_content)
+            emit(_section_header("🧹 DATA CLEANING LOG") + f"{cleaning_info}\n\n")
+
+            # 2) Describe
+            _progress(on_progress, 0.25, "Understanding the dataset...")
+            emit(_section_header("📊 DATASET UNDERSTANDING"))
+            dataset_summary = describe_dataset(df_clean, cleaning_info, on_chunk=on_chunk, profile_text=profile_text)
+            emit("\n\n")
+
+            # 3) Plan dashboard (RAG)
+            _progress(on_progress, 0.55, "Planning the dashboard...")
+            emit(_section_header("📈 POWER BI DASHBOARD PLAN (RAG-GROUNDED)"))
+            planner = ReportGeneratorAgent(query_engine)
+            dashboard_plan = planner.generate_report_plan(dataset_summary, cleaning_info, on_chunk=on_chunk)
+
+            # 4) Combine
+            usage = _ledger_section(ledger)
+            emit(usage)
+            final_text = _compose_csv_report(cleaning_info, dataset_summary, dashboard_plan) + usage
+
+            _progress(on_progress, 0.9, "Exporting PDF...")
+            with span("export_pdf"):
+                pdf_bytes = ExportAgent().to_pdf_bytes(final_text)
+            _progress(on_progress, 1.0, "Analysis complete!")
+            return final_text, pdf_bytes
+
+        elif file_type == "pdf":
+            # 1) Extract text
+            _progress(on_progress, 0.05, "Extracting text from PDF...")
+            with span("pdf_text"):
+                pdf_text = _pdf_text_from(file_content)
+
+            # 2) Analyze
+            _progress(on_progress, 0.2, "Generating insights...")
+            insight_agent = InsightAgent(model=ANALYSIS_MODEL)
+            insights = insight_agent.generate_insights(pdf_text, on_chunk=on_chunk,
+                                                       on_progress=_scaled(on_progress, 0.2, 0.9))
+            usage = _ledger_section(ledger)
+            emit(usage)
+            insights += usage
+
+            # 3) Export
+            _progress(on_progress, 0.9, "Exporting PDF...")
+            with span("export_pdf"):
+                pdf_bytes = ExportAgent().to_pdf_bytes(insights)
+
+            _progress(on_progress, 1.0, "Analysis complete!")
+            return insights, pdf_bytes
+
+        else:
+            raise ValueError("file_type must be either 'csv' or 'pdf'")
+
+
+async def achat_with_agents(file_type, file_content, query_engine=None, ledger=None,
+                            on_progress=None, cancel_token=None):
+    """
+    Async version of chat_with_agents() for serving many analyses from one event loop.
+    LLM and RAG calls are awaited; CPU-bound parsing, cleaning, token counting and
+    PDF export, and the SQLite response cache, run in worker threads so they never
+    block the loop. Returns the same (text, pdf_bytes).
+    Cancelling the task itself also works; cancel_token stops it at the next checkpoint.
+    """
+    ledger = ledger if ledger is not None else TokenLedger()
+
+    if query_engine is None:
+        raise ValueError("query_engine is None. Call build_index() first in your Streamlit app.")
+
+    with ledger_scope(ledger), cancel_scope(cancel_token), metrics.run("analysis", file_type=file_type):
+        if file_type == "csv":
+            _progress(on_progress, 0.05, "Cleaning data...")
+            df_clean, cleaning_info, profile_text = await asyncio.to_thread(_load_and_clean_csv, file_content)
+
+            _progress(on_progress, 0.25, "Understanding the dataset...")
+            dataset_summary = await adescribe_dataset(df_clean, cleaning_info, profile_text=profile_text)
+
+            _progress(on_progress, 0.55, "Planning the dashboard...")
+            planner = ReportGeneratorAgent(query_engine)
+            dashboard_plan = await planner.agenerate_report_plan(dataset_summary, cleaning_info)
 
-        exporter = ExportAgent(output_filename="dashboard_output.pdf")
-        pdf_path = exporter.save_as_pdf(final_text)
-        return final_text, pdf_path
+            final_text = _compose_csv_report(cleaning_info, dataset_summary, dashboard_plan) + _ledger_section(ledger)
+
+            _progress(on_progress, 0.9, "Exporting PDF...")
+            with span("export_pdf"):
+                pdf_bytes = await asyncio.to_thread(ExportAgent().to_pdf_bytes, final_text)
+            _progress(on_progress, 1.0, "Analysis complete!")
+            return final_text, pdf_bytes
+
+        elif file_type == "pdf":
+            _progress(on_progress, 0.05, "Extracting text from PDF...")
+            with span("pdf_text"):
+                pdf_text = await asyncio.to_thread(_pdf_text_from, file_content)
+
+            _progress(on_progress, 0.2, "Generating insights...")
+            insight_agent = InsightAgent(model=ANALYSIS_MODEL)
+            insights = await insight_agent.agenerate_insights(pdf_text, on_progress=_scaled(on_progress, 0.2, 0.9))
+            insights += _ledger_section(ledger)
+
+            _progress(on_progress, 0.9, "Exporting PDF...")
+            with span("export_pdf"):
+                pdf_bytes = await asyncio.to_thread(ExportAgent().to_pdf_bytes, insights)
+
+            _progress(on_progress, 1.0, "Analysis complete!")
+            return insights, pdf_bytes
 
-    elif file_type == "pdf":
-        # 1) Extract text
-        if isinstance(file_content, (bytes, bytearray)):
-            pdf_text = extract_pdf_text(file_content)
         else:
-            # If the caller already extracted text (not recommended), accept it
-            pdf_text = str(file_content)
+            raise ValueError("file_type must be either 'csv' or 'pdf'")
 
-        # 2) Analyze
-        insight_agent = InsightAgent(model="gpt-4o")
-        insights = insight_agent.generate_insights(pdf_text)
 
-        # 3) Export
-        exporter = ExportAgent(output_filename="pdf_insight_summary.pdf")
-        pdf_path = exporter.save_as_pdf(insights)
+def initialize_system(background=True):
+    """
+    Warm up the shared RAG index. With background=True the build runs in a daemon
+    thread (started at most once per process) and this returns immediately;
+    otherwise it blocks and returns the query engine.
+    """
+    global _warmup_thread
 
-        return insights, pdf_path
+    if not background:
+        return build_index()
 
-    else:
-        raise ValueError("file_type must be either 'csv' or 'pdf'")
+    with _warmup_lock:
+        if _warmup_thread is None and _index_status["state"] == "idle":
+            _warmup_thread = threading.Thread(target=_warm_up, name="rag-warmup", daemon=True)
+            _warmup_thread.start()
+    return None
+
+
+def _warm_up():
+    try:
+        build_index()
+    except Exception as e:
+        print(f"❌ RAG index warm-up failed: {e}")
 
 
-def initialize_system():
-    """Initialize the RAG system and return query engine"""
-    return build_index()
+_import_seconds[__name__] = time.perf_counter() - _import_started
+metrics.observe(f"import:{__name__}", _import_seconds[__name__], status="ok")
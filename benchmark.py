@@ -0,0 +1,423 @@
+"""
+Offline Benchmarks for InsightPilot
+(Times every pipeline stage on synthetic CSVs and PDFs with deterministic local
+stand-ins for OpenAI chat and embeddings, and flags regressions against a baseline)
+
+Usage:
+    python benchmark.py                      # quick profile, compare with the baseline
+    python benchmark.py --profile full       # 10k–10M rows, 1–1000 pages
+    python benchmark.py --save-baseline      # record this run as the new baseline
+    python benchmark.py --only csv,pdf --repeat 5 --threshold 0.25
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime
+from pathlib import Path
+
+# Never replay cached answers: set before the backend is imported
+os.environ["INSIGHTPILOT_LLM_CACHE"] = "0"
+
+import fitz  # PyMuPDF
+import numpy as np
+import pandas as pd
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms import MockLLM
+
+BENCH_DIR = Path(os.getenv("INSIGHTPILOT_BENCH_DIR", ".bench"))
+BASELINE_FILE = Path(os.getenv("INSIGHTPILOT_BENCH_BASELINE", str(BENCH_DIR / "baseline.json")))
+# A stage regresses when it is this much slower than the baseline...
+REGRESSION_THRESHOLD = float(os.getenv("INSIGHTPILOT_BENCH_THRESHOLD", "0.2"))
+# ...and slower by at least this many seconds (ignores jitter on very fast stages)
+REGRESSION_MIN_SECONDS = 0.01
+
+PROFILES = {
+    "quick": {"csv_rows": (10_000, 100_000), "pdf_pages": (1, 10, 100), "queries": 10, "export_chars": 20_000},
+    "full": {
+        "csv_rows": (10_000, 100_000, 1_000_000, 10_000_000),
+        "pdf_pages": (1, 10, 100, 1000),
+        "queries": 50,
+        "export_chars": 200_000,
+    },
+}
+SUITES = ("startup", "csv", "pdf", "index", "export")
+# Loaded lazily by the backend; imported up front so stage timings exclude them
+LAZY_MODULES = ("openai", "fpdf", "pdf_extract", "rag_index", "llama_index.core")
+
+QUERIES = (
+    "Which visuals suit a sales trend over time?",
+    "How should KPIs be laid out on a dashboard page?",
+    "Write a DAX measure for year-over-year growth",
+    "When should I use a slicer instead of a filter?",
+    "What colours work for accessible reports?",
+)
+
+_WORDS = (
+    "revenue growth margin customer region quarter forecast churn segment pipeline target "
+    "variance budget retention conversion channel product market share cost profit trend"
+).split()
+
+
+# ---------------------------
+# Local stand-ins
+# ---------------------------
+class HashEmbedding(BaseEmbedding):
+    """Deterministic bag-of-words embedding (hashed token counts, L2-normalised)"""
+
+    embed_dim: int = 256
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "HashEmbedding"
+
+    def _vector(self, text: str):
+        vec = np.zeros(self.embed_dim)
+        for word in text.lower().split():
+            vec[int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), "little") % self.embed_dim] += 1
+        norm = np.linalg.norm(vec)
+        return (vec / norm if norm else vec).tolist()
+
+    def _get_text_embedding(self, text: str):
+        return self._vector(text)
+
+    def _get_query_embedding(self, query: str):
+        return self._vector(query)
+
+    async def _aget_text_embedding(self, text: str):
+        return self._vector(text)
+
+    async def _aget_query_embedding(self, query: str):
+        return self._vector(query)
+
+
+def _stub_answer(model: str, messages) -> str:
+    """A fixed-size answer derived from the prompt, so the same prompt always gets the same text"""
+    seed = int.from_bytes(hashlib.sha256(repr((model, messages)).encode()).digest()[:4], "little")
+    rng = np.random.default_rng(seed)
+    return " ".join(rng.choice(_WORDS, 300))
+
+
+class _StubCompletions:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def create(self, model, messages, stream=False, **params):
+        time.sleep(self.latency)
+        text = _stub_answer(model, messages)
+        if stream:
+            return iter(
+                types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=word + " "))])
+                for word in text.split()
+            )
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=text))])
+
+
+class _AsyncStubCompletions(_StubCompletions):
+    async def create(self, model, messages, stream=False, **params):
+        import asyncio
+        await asyncio.sleep(self.latency)
+        text = _stub_answer(model, messages)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=text))])
+
+
+def install_stubs(backend, llm_latency=0.0):
+    """Point backend's OpenAI clients at the local stand-ins"""
+    backend.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_StubCompletions(llm_latency)))
+    backend.aclient = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_AsyncStubCompletions(llm_latency)))
+
+
+# ---------------------------
+# Synthetic inputs
+# ---------------------------
+REGIONS = np.array(["North", "South", "East", "West", "Central"])
+PRODUCTS = np.array([f"Product {c}" for c in "ABCDEFGHIJKLMNOP"])
+CSV_BLOCK_ROWS = 1_000_000
+
+
+def _csv_block(rows: int, start: int, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "order_id": np.arange(start, start + rows),
+        "order_date": (np.datetime64("2022-01-01") + rng.integers(0, 1095, rows).astype("timedelta64[D]")).astype(str),
+        "region": rng.choice(REGIONS, rows),
+        "product": rng.choice(PRODUCTS, rows),
+        "units": rng.integers(1, 50, rows),
+        "unit_price": rng.gamma(2.0, 20.0, rows).round(2),
+        "discount": np.where(rng.random(rows) < 0.1, np.nan, rng.random(rows).round(2)),
+        "notes": np.where(rng.random(rows) < 0.7, None, rng.choice(_WORDS, rows)),
+    })
+    # About 1% exact duplicates, as in real exports
+    return pd.concat([df, df.iloc[rng.integers(0, rows, max(rows // 100, 1))]], ignore_index=True)
+
+
+def synthetic_csv(rows: int) -> Path:
+    """Sales-like CSV with nulls, dates, categories and duplicates; written once and reused"""
+    path = BENCH_DIR / "data" / f"sales_{rows}.csv"
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    print(f"🛠️ Generating {path} ...")
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        for block, start in enumerate(range(0, rows, CSV_BLOCK_ROWS)):
+            _csv_block(min(CSV_BLOCK_ROWS, rows - start), start, seed=block).to_csv(f, index=False, header=block == 0)
+    tmp.replace(path)
+    return path
+
+
+def _draw_table(page, top: float, rng):
+    """Ruled 4x5 table so find_tables() has something to detect"""
+    left, col_w, row_h = 72, 110, 18
+    header = ["Region", "Revenue", "Margin", "Growth"]
+    for r in range(5):
+        for c in range(4):
+            rect = fitz.Rect(left + c * col_w, top + r * row_h, left + (c + 1) * col_w, top + (r + 1) * row_h)
+            page.draw_rect(rect, width=0.5)
+            text = header[c] if r == 0 else (REGIONS[r - 1] if c == 0 else f"{rng.random() * 1000:.1f}")
+            page.insert_text((rect.x0 + 4, rect.y1 - 5), str(text), fontsize=9)
+    return top + 5 * row_h + 20
+
+
+def synthetic_pdf(pages: int) -> Path:
+    """Report-like PDF: repeated header/footer, numbered pages, prose and a table every 3rd page"""
+    path = BENCH_DIR / "data" / f"report_{pages}.pdf"
+    if path.exists():
+        return path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    print(f"🛠️ Generating {path} ...")
+    rng = np.random.default_rng(pages)
+    doc = fitz.open()
+    for n in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_text((72, 40), "ACME Corp · Quarterly Business Review · Confidential", fontsize=8)
+        page.insert_text((72, 80), f"Section {n}: {' '.join(rng.choice(_WORDS, 4)).title()}", fontsize=14)
+        y = 110
+        if n % 3 == 0:
+            y = _draw_table(page, y, rng)
+        for _ in range(6):
+            paragraph = " ".join(rng.choice(_WORDS, 60))
+            page.insert_textbox(fitz.Rect(72, y, 540, y + 90), paragraph, fontsize=10)
+            y += 95
+        page.insert_text((300, 810), str(n), fontsize=8)
+    tmp = path.with_name(path.name + ".tmp")
+    doc.save(tmp)
+    doc.close()
+    tmp.replace(path)
+    return path
+
+
+def synthetic_report_text(chars: int) -> str:
+    rng = np.random.default_rng(chars)
+    lines = []
+    while sum(len(line) + 1 for line in lines) < chars:
+        lines.append(" ".join(rng.choice(_WORDS, 12)).capitalize() + ".")
+    return "\n".join(lines)[:chars]
+
+
+# ---------------------------
+# Runner
+# ---------------------------
+class BenchmarkRun:
+    """Median-of-repeats timings keyed "suite.stage@size" """
+
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results = {}
+
+    def time(self, key: str, fn, setup=None, repeat=None):
+        """Time fn() `repeat` times (setup() runs untimed before each); returns fn's last result"""
+        runs = []
+        result = None
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            result = fn()
+            runs.append(time.perf_counter() - started)
+        self.results[key] = {"seconds": statistics.median(runs), "runs": [round(r, 6) for r in runs]}
+        print(f"⏱️ {key:<40} {self.results[key]['seconds']:9.4f}s")
+        return result
+
+
+def bench_csv(run: BenchmarkRun, backend, rows_list):
+    import csv_ingest
+    from profiling import summarize_profile
+
+    for rows in rows_list:
+        data = synthetic_csv(rows).read_bytes()
+        upload = run.time(f"csv.read@{rows}", lambda: csv_ingest.parse_upload(data),
+                          setup=csv_ingest._uploads.clear)
+        df, cleaning_info, profile_text = run.time(f"csv.clean@{rows}", lambda: backend._load_and_clean_csv(upload))
+        # Streamed uploads are profiled during chunked cleaning (csv.clean above)
+        if upload.complete:
+            run.time(f"csv.profile@{rows}", lambda: summarize_profile(df))
+        run.time(f"csv.describe@{rows}",
+                 lambda: backend.describe_dataset(df, cleaning_info, profile_text=profile_text))
+
+
+def bench_pdf(run: BenchmarkRun, backend, pages_list):
+    from pdf_extract import PageTextCache, extract_pdf
+
+    for pages in pages_list:
+        data = synthetic_pdf(pages).read_bytes()
+        extraction = run.time(f"pdf.extract@{pages}", lambda: extract_pdf(data, cache=None))
+        cache = PageTextCache()
+        extract_pdf(data, cache=cache)
+        run.time(f"pdf.extract_cached@{pages}", lambda: extract_pdf(data, cache=cache))
+        run.time(f"pdf.insights@{pages}", lambda: backend.InsightAgent().generate_insights(extraction.prompt_text))
+
+
+def bench_index(run: BenchmarkRun, queries: int):
+    from rag_index import DATA_DIR, load_or_build_index
+
+    embed_model = HashEmbedding()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # A cold build only happens once per cache dir, so it is timed once
+        index = run.time("index.build", lambda: load_or_build_index(embed_model, DATA_DIR, cache_dir), repeat=1)
+        run.time("index.load", lambda: load_or_build_index(embed_model, DATA_DIR, cache_dir))
+
+    questions = [QUERIES[i % len(QUERIES)] for i in range(queries)]
+    retriever = index.as_retriever(similarity_top_k=3)
+    engine = index.as_query_engine(llm=MockLLM(max_tokens=256), similarity_top_k=3)
+    run.time(f"index.retrieve@{queries}q", lambda: [retriever.retrieve(q) for q in questions])
+    run.time(f"index.query@{queries}q", lambda: [engine.query(q) for q in questions])
+
+
+def _cold_import_seconds(module: str) -> float:
+    """Import time of module in a fresh interpreter (no warm sys.modules)"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                         cwd=Path(__file__).resolve().parent)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(run: BenchmarkRun):
+    """Cold import of the backend, i.e. what app.py pays before its first page paint"""
+    runs = [_cold_import_seconds("backend1_integration") for _ in range(run.repeat)]
+    run.results["startup.import_backend"] = {"seconds": statistics.median(runs), "runs": [round(r, 6) for r in runs]}
+    print(f"⏱️ {'startup.import_backend':<40} {run.results['startup.import_backend']['seconds']:9.4f}s")
+
+
+def warm_up(backend):
+    for name in LAZY_MODULES:
+        importlib.import_module(name)
+    backend.count_tokens("warm up the tokenizer")
+
+
+def bench_export(run: BenchmarkRun, backend, chars: int):
+    text = synthetic_report_text(chars)
+    run.time(f"export.pdf@{chars}c", lambda: backend.ExportAgent().to_pdf_bytes(text))
+
+
+# ---------------------------
+# Baselines
+# ---------------------------
+def _environment(profile: str) -> dict:
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "profile": profile,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def save_results(path: Path, results: dict, profile: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps({**_environment(profile), "results": results}, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+
+def compare(results: dict, baseline: dict, threshold=REGRESSION_THRESHOLD) -> list:
+    """Print current vs baseline per stage; returns the keys that regressed"""
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"🆕 {key:<40} {current['seconds']:9.4f}s (no baseline)")
+            continue
+        now, before = current["seconds"], base["seconds"]
+        change = now / before - 1 if before else 0.0
+        if now > before * (1 + threshold) and now - before > REGRESSION_MIN_SECONDS:
+            regressions.append(key)
+            mark = "🔴"
+        elif before > now * (1 + threshold) and before - now > REGRESSION_MIN_SECONDS:
+            mark = "🟢"
+        else:
+            mark = "⚪"
+        print(f"{mark} {key:<40} {before:9.4f}s → {now:9.4f}s ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline InsightPilot pipeline benchmarks")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="quick")
+    parser.add_argument("--only", default=",".join(SUITES), help=f"comma-separated subset of {', '.join(SUITES)}")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage (the median is kept)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds each stubbed chat call sleeps")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative slowdown that counts as a regression (0.2 = 20%%)")
+    parser.add_argument("--output", type=Path, default=BENCH_DIR / "latest.json")
+    args = parser.parse_args(argv)
+
+    suites = [s.strip() for s in args.only.split(",") if s.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+
+    profile = PROFILES[args.profile]
+    run = BenchmarkRun(max(args.repeat, 1))
+    if "startup" in suites:
+        bench_startup(run)
+
+    import backend1_integration as backend
+    install_stubs(backend, args.llm_latency)
+    warm_up(backend)
+
+    if "csv" in suites:
+        bench_csv(run, backend, profile["csv_rows"])
+    if "pdf" in suites:
+        bench_pdf(run, backend, profile["pdf_pages"])
+    if "index" in suites:
+        bench_index(run, profile["queries"])
+    if "export" in suites:
+        bench_export(run, backend, profile["export_chars"])
+
+    save_results(args.output, run.results, args.profile)
+    print(f"💾 Results written to {args.output}")
+
+    if args.save_baseline:
+        save_results(args.baseline, run.results, args.profile)
+        print(f"📌 Baseline saved to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"ℹ️ No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+    if baseline.get("profile") != args.profile or baseline.get("platform") != platform.platform():
+        print(f"⚠️ Baseline was recorded with profile {baseline.get('profile')!r} on {baseline.get('platform')}")
+    print(f"\n📊 Compared with the baseline from {baseline.get('created')} (threshold {args.threshold:.0%}):")
+    regressions = compare(run.results, baseline["results"], args.threshold)
+    if regressions:
+        print(f"❌ {len(regressions)} stage(s) regressed: {', '.join(regressions)}")
+        return 1
+    print("✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
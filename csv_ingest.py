@@ -0,0 +1,370 @@
+"""
+CSV Ingestion for InsightPilot
+(Chunked reading and cleaning so multi-GB uploads run in roughly constant memory)
+"""
+
+import csv
+import codecs
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from metrics import metrics
+
+try:
+    import pyarrow  # noqa: F401  (enables pandas' multithreaded engine="pyarrow")
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+CSV_CHUNK_ROWS = int(os.getenv("INSIGHTPILOT_CSV_CHUNK_ROWS", "200000"))
+# Uploads larger than this are cleaned chunk by chunk instead of loaded whole
+CSV_STREAM_THRESHOLD_MB = float(os.getenv("INSIGHTPILOT_CSV_STREAM_THRESHOLD_MB", "100"))
+# How many parsed uploads (by content hash) are kept in memory for reuse, and how much
+# memory (raw bytes + parsed frame) they may hold in total. Uploads above the
+# streaming threshold are never cached.
+UPLOAD_CACHE_ENTRIES = int(os.getenv("INSIGHTPILOT_UPLOAD_CACHE_ENTRIES", "8"))
+UPLOAD_CACHE_MB = float(os.getenv("INSIGHTPILOT_UPLOAD_CACHE_MB", "256"))
+PREVIEW_ROWS = 1000
+SNIFF_BYTES = 64 * 1024
+# Text columns with at most this share of distinct values become pandas categories
+CATEGORY_MAX_RATIO = 0.5
+
+
+def source_size(source) -> int:
+    """Byte size of a path, bytes object or file-like upload (0 if unknown)"""
+    if isinstance(source, (bytes, bytearray)):
+        return len(source)
+    if isinstance(source, io.BytesIO):
+        return source.getbuffer().nbytes
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    return 0
+
+
+def should_stream(source) -> bool:
+    return source_size(source) > CSV_STREAM_THRESHOLD_MB * 1024 * 1024
+
+
+def _rewind(source):
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+# ---------------------------
+# Fast reader
+# ---------------------------
+def sniff_csv(data: bytes, sample_bytes=SNIFF_BYTES) -> dict:
+    """Guess encoding and delimiter from the first sample_bytes of the file"""
+    sample = data[:sample_bytes]
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = "utf-8-sig"
+    elif sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = "utf-16"
+    else:
+        encoding = "utf-8"
+        try:
+            # The sample may end mid-character; only reject real decode errors
+            codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        except UnicodeDecodeError:
+            encoding = "latin-1"
+
+    # Sniff from whole lines only; the last line of the sample may be cut short
+    lines = sample.decode(encoding, errors="ignore").splitlines()[:50]
+    if len(lines) > 1 and len(sample) == sample_bytes:
+        lines = lines[:-1]
+    try:
+        delimiter = csv.Sniffer().sniff("\n".join(lines), delimiters=",;\t|").delimiter
+    except csv.Error:
+        delimiter = ","
+    return {"encoding": encoding, "delimiter": delimiter}
+
+
+def optimize_dtypes(df: pd.DataFrame, category_max_ratio=CATEGORY_MAX_RATIO) -> pd.DataFrame:
+    """
+    Shrink a freshly parsed frame in place: integers go to the smallest int type,
+    floats to float32 when that is lossless, and repetitive text to category.
+    """
+    for i in range(df.shape[1]):
+        col = df.iloc[:, i]
+        kind = col.dtype.kind
+        if kind in "iu":
+            col = pd.to_numeric(col, downcast="unsigned" if col.min() >= 0 else "integer")
+        elif kind == "f":
+            narrow = col.astype("float32")
+            if ((narrow.astype("float64") == col) | col.isna()).all():
+                col = narrow
+        elif kind == "O" and len(col) and col.nunique(dropna=False) <= category_max_ratio * len(col):
+            col = col.astype("category")
+        else:
+            continue
+        df.isetitem(i, col)
+    return df
+
+
+def read_csv_fast(data: bytes, nrows=None):
+    """
+    Parse CSV bytes using sniffed settings, the pyarrow engine when installed
+    (full reads only) and memory-lean dtypes. Returns (df, read_report).
+    """
+    started = time.perf_counter()
+    settings = sniff_csv(data)
+    encoding, delimiter = settings["encoding"], settings["delimiter"]
+    engine = "pyarrow" if HAS_PYARROW and nrows is None else "c"
+
+    df = None
+    if engine == "pyarrow":
+        try:
+            df = pd.read_csv(io.BytesIO(data), encoding=encoding, sep=delimiter, engine="pyarrow")
+        except Exception:
+            # Bad bytes past the sniffed prefix, or input the pyarrow engine rejects: retry
+            # with the C parser, which adds the latin-1 fallback below (malformed rows,
+            # e.g. an extra field, still raise ParserError there)
+            engine = "c"
+    if df is None:
+        try:
+            df = pd.read_csv(io.BytesIO(data), encoding=encoding, sep=delimiter, nrows=nrows)
+        except UnicodeDecodeError:
+            encoding = "latin-1"
+            df = pd.read_csv(io.BytesIO(data), encoding=encoding, sep=delimiter, nrows=nrows)
+
+    parse_seconds = time.perf_counter() - started
+    parsed_bytes = int(df.memory_usage(deep=True).sum())
+    started = time.perf_counter()
+    optimize_dtypes(df)
+    report = {
+        "encoding": encoding,
+        "delimiter": delimiter,
+        "engine": engine,
+        "parse_seconds": round(parse_seconds, 3),
+        "optimize_seconds": round(time.perf_counter() - started, 3),
+        "memory_parsed_bytes": parsed_bytes,
+        "memory_optimized_bytes": int(df.memory_usage(deep=True).sum()),
+    }
+    return df, report
+
+
+# ---------------------------
+# Row-hash deduplication
+# ---------------------------
+_HASH_PRIME = np.uint64(0x100000001B3)
+
+
+def row_hashes(df: pd.DataFrame, positions=None) -> np.ndarray:
+    """
+    64-bit hash per row over the columns at positions (default: all), combined
+    column by column so no sub-frame is ever copied. Two different rows collide
+    with probability ~2^-64, i.e. ~1e-6 for 5M rows.
+    """
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for i in range(df.shape[1]) if positions is None else positions:
+            hashes *= _HASH_PRIME
+            hashes ^= pd.util.hash_pandas_object(df.iloc[:, i], index=False).to_numpy()
+    return hashes
+
+
+class _SeenHashes:
+    """Sorted uint64 row hashes seen so far (8 bytes per distinct row)"""
+
+    def __init__(self):
+        self.values = np.empty(0, dtype=np.uint64)
+
+    def first_occurrences(self, hashes: np.ndarray) -> np.ndarray:
+        """Mask of rows whose hash was not seen before (in earlier chunks or earlier in this one)"""
+        _, first_idx = np.unique(hashes, return_index=True)
+        mask = np.zeros(len(hashes), dtype=bool)
+        mask[first_idx] = True
+
+        if len(self.values):
+            pos = np.searchsorted(self.values, hashes)
+            pos[pos == len(self.values)] = 0
+            mask &= self.values[pos] != hashes
+
+        new = np.sort(hashes[mask])
+        self.values = np.sort(np.concatenate([self.values, new]), kind="mergesort")
+        return mask
+
+
+# ---------------------------
+# Chunked cleaning
+# ---------------------------
+def _clean_chunks(source, encoding: str, chunksize: int, sep: str, profiler=None):
+    reader = pd.read_csv(source, encoding=encoding, sep=sep, chunksize=chunksize, dtype=str)
+
+    columns = None
+    non_empty = None
+    null_counts = None
+    seen = _SeenHashes()
+    total_rows = unique_rows = 0
+
+    for chunk in reader:
+        if columns is None:
+            columns = list(chunk.columns)
+            unnamed = chunk.columns.str.contains('^Unnamed')
+            hash_pos = [i for i, skip in enumerate(unnamed) if not skip]
+            hash_cols = [columns[i] for i in hash_pos]
+            non_empty = pd.Series(False, index=chunk.columns)
+            null_counts = pd.Series(0, index=chunk.columns, dtype="int64")
+
+        total_rows += len(chunk)
+        non_empty |= chunk.notna().any()
+
+        hashes = row_hashes(chunk, hash_pos)
+        keep = seen.first_occurrences(hashes)
+        unique_rows += int(keep.sum())
+        null_counts += chunk[keep].isna().sum()
+        if profiler is not None:
+            profiler.update(chunk.loc[keep, hash_cols])
+
+    if columns is None:
+        raise pd.errors.EmptyDataError("No columns to parse from file")
+    return columns, non_empty, null_counts, total_rows, unique_rows
+
+
+def clean_and_summarize_chunked(source, chunksize=CSV_CHUNK_ROWS, preview_rows=PREVIEW_ROWS,
+                                encoding=None, sep=",", profiler=None):
+    """
+    Streaming counterpart of clean_and_summarize(): reads the CSV in chunks and
+    builds the same cleaning report (empty / unnamed columns, duplicate rows via
+    64-bit row hashes, missing values) without materialising the whole frame.
+    Returns (preview_df, cleaning_report) where preview_df holds the first
+    preview_rows cleaned rows for schema and sample-row prompts.
+    encoding (e.g. sniffed from a prefix) is tried first, utf-8 without one; on a
+    decode error past that point the file is re-read as latin-1.
+    A profiling.SketchProfiler passed as profiler is fed the de-duplicated rows.
+    """
+    def _attempt(enc):
+        # Profile into a scratch profiler so a failed utf-8 pass leaves no partial state
+        scratch = type(profiler)() if profiler is not None else None
+        result = _clean_chunks(_rewind(source), enc, chunksize, sep, scratch)
+        if profiler is not None:
+            profiler.merge(scratch)
+        return result
+
+    encoding = encoding or "utf-8"
+    try:
+        stats = _attempt(encoding)
+    except UnicodeDecodeError:
+        # latin-1 decodes any byte sequence
+        encoding = "latin-1"
+        stats = _attempt(encoding)
+    columns, non_empty, null_counts, total_rows, unique_rows = stats
+
+    cleaning_report = []
+    empty_cols = [c for c in columns if not non_empty[c]]
+    if empty_cols:
+        cleaning_report.append(f"Removed empty columns: {empty_cols}")
+    unnamed_cols = [c for c in columns if c not in empty_cols and c.startswith('Unnamed')]
+    if unnamed_cols:
+        cleaning_report.append(f"Removed unnamed columns: {unnamed_cols}")
+    kept = [c for c in columns if c not in empty_cols and c not in unnamed_cols]
+
+    if total_rows != unique_rows:
+        cleaning_report.append(f"Removed {total_rows - unique_rows} duplicate rows")
+    if null_counts[kept].sum() > 0:
+        cleaning_report.append("Missing values detected in some columns.")
+
+    stripped = [str(c).strip() for c in kept]
+    cleaning_report.append(
+        f"Final dataset shape after cleaning: {(unique_rows, len(kept))} "
+        f"(original was {(total_rows, len(columns))})"
+    )
+    cleaning_report.append("Columns after cleaning: " + ", ".join(stripped[:8]) + ("..." if len(stripped) > 8 else ""))
+
+    preview = pd.read_csv(_rewind(source), encoding=encoding, sep=sep, nrows=preview_rows)[kept].drop_duplicates()
+    preview.columns = stripped
+    return preview, "\n".join(cleaning_report)
+
+
+# ---------------------------
+# Parse-once uploads
+# ---------------------------
+class ParsedUpload:
+    """
+    An uploaded CSV parsed once and shared by the preview, cleaning and the
+    dataset description. Uploads above the streaming threshold only parse the
+    first rows (complete=False) and are cleaned chunk by chunk from data.
+    read_report records the sniffed settings, engine, parse time and memory.
+    """
+
+    def __init__(self, data: bytes, digest: str, df: pd.DataFrame, complete: bool, read_report: dict):
+        self.data = data
+        self.digest = digest
+        self.df = df
+        self.complete = complete
+        self.read_report = read_report
+
+    @property
+    def encoding(self) -> str:
+        return self.read_report["encoding"]
+
+    @property
+    def delimiter(self) -> str:
+        return self.read_report["delimiter"]
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Raw bytes plus the parsed frame, as held by the upload cache"""
+        return self.size + self.read_report["memory_optimized_bytes"]
+
+    def source(self):
+        """Fresh file-like view of the raw bytes"""
+        return io.BytesIO(self.data)
+
+
+_uploads = OrderedDict()
+_uploads_lock = threading.Lock()
+
+
+def parse_upload(data: bytes) -> ParsedUpload:
+    """
+    Parse CSV bytes, reusing the cached result for identical content. The cache
+    is bounded by UPLOAD_CACHE_ENTRIES and UPLOAD_CACHE_MB; streamed uploads
+    are not cached, so their raw bytes are freed once the session drops them.
+    """
+    data = bytes(data)
+    digest = hashlib.sha256(data).hexdigest()
+    with _uploads_lock:
+        if digest in _uploads:
+            _uploads.move_to_end(digest)
+            return _uploads[digest]
+
+    complete = not should_stream(data)
+    df, read_report = read_csv_fast(data, nrows=None if complete else PREVIEW_ROWS)
+    metrics.observe("csv_parse", read_report["parse_seconds"] + read_report["optimize_seconds"],
+                    status="ok", engine=read_report["engine"], complete=complete)
+    upload = ParsedUpload(data, digest, df, complete, read_report)
+
+    max_bytes = UPLOAD_CACHE_MB * 1024 * 1024
+    if complete and upload.memory_bytes <= max_bytes:
+        with _uploads_lock:
+            _uploads[digest] = upload
+            while len(_uploads) > UPLOAD_CACHE_ENTRIES or sum(u.memory_bytes for u in _uploads.values()) > max_bytes:
+                _uploads.popitem(last=False)
+    return upload
+
+
+def as_parsed_upload(file_content) -> ParsedUpload:
+    """Accept a ParsedUpload, raw bytes or a file-like object"""
+    if isinstance(file_content, ParsedUpload):
+        return file_content
+    if isinstance(file_content, (bytes, bytearray)):
+        return parse_upload(file_content)
+    if isinstance(file_content, io.BytesIO):
+        return parse_upload(file_content.getvalue())
+    _rewind(file_content)
+    return parse_upload(file_content.read())
@@ -0,0 +1,418 @@
+"""
+Analysis Jobs for InsightPilot
+(A bounded queue and local worker pool that run analyses outside the Streamlit
+script thread, with job IDs, status polling and results persisted to disk)
+"""
+
+import hashlib
+import io
+import json
+import math
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from metrics import metrics
+
+JOB_WORKERS = int(os.getenv("INSIGHTPILOT_JOB_WORKERS", "2"))
+# Submissions beyond this many waiting jobs are refused (QueueFullError)
+JOB_QUEUE_SIZE = int(os.getenv("INSIGHTPILOT_JOB_QUEUE_SIZE", "8"))
+JOB_DIR = Path(os.getenv("INSIGHTPILOT_JOB_DIR", ".jobs"))
+JOB_RETENTION_HOURS = float(os.getenv("INSIGHTPILOT_JOB_RETENTION_HOURS", "24"))
+# A job is cancelled when none of its sessions has polled it for this long (tabs closed)
+JOB_ABANDON_SECONDS = float(os.getenv("INSIGHTPILOT_JOB_ABANDON_SECONDS", "60"))
+# Stored jobs are pruned at most this often (checked on submit and when a job finishes)
+JOB_PRUNE_INTERVAL_SECONDS = 15 * 60
+# Finished jobs kept in memory for fast polling; older ones are reloaded from disk
+MAX_FINISHED_IN_MEMORY = 32
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class QueueFullError(RuntimeError):
+    """Raised by submit() when JOB_QUEUE_SIZE jobs are already waiting"""
+
+
+class Job:
+    """
+    One analysis: its input while queued, live progress and streamed text while
+    running, and the report text / PDF bytes once done. Workers update it; the
+    UI only reads it (snapshot(), text()).
+    """
+
+    def __init__(self, file_type: str, file_content=None, file_name=None, job_id=None, key=None):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.key = key
+        self.file_type = file_type
+        self.file_name = file_name
+        self.file_content = file_content
+        self.state = QUEUED
+        self.progress = 0.0
+        self.message = "Waiting for a free worker..."
+        self.result = None
+        self.pdf = None  # PDF bytes, kept while the job is in memory
+        self.pdf_path = None  # stored copy, for jobs reloaded from disk
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_token = None
+        # Sessions following this job -> when each last polled it; the job is cancelled
+        # once all of them cancel or stop polling
+        self.subscribers = {}
+        self._chunks = []
+        self._lock = threading.Lock()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def append(self, text: str):
+        with self._lock:
+            self._chunks.append(text)
+
+    def set_progress(self, fraction: float, message: str):
+        self.progress, self.message = fraction, message
+
+    def text(self) -> str:
+        """Final report, or the text streamed so far while running"""
+        if self.result is not None:
+            return self.result
+        with self._lock:
+            return "".join(self._chunks)
+
+    def pdf_bytes(self):
+        if self.pdf is None and self.pdf_path and Path(self.pdf_path).exists():
+            return Path(self.pdf_path).read_bytes()
+        return self.pdf
+
+    def snapshot(self) -> dict:
+        return {
+            "id": self.id,
+            "file_type": self.file_type,
+            "file_name": self.file_name,
+            "state": self.state,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+    def to_dict(self) -> dict:
+        return {**self.snapshot(), "result": self.result, "pdf_path": self.pdf_path}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Job":
+        job = cls(data["file_type"], file_name=data.get("file_name"), job_id=data["id"])
+        for field in ("state", "progress", "message", "error", "created", "started", "finished", "result", "pdf_path"):
+            setattr(job, field, data.get(field))
+        return job
+
+
+# ---------------------------
+# Storage
+# ---------------------------
+class JobStore:
+    """One directory per job under root: job.json (status + report) and report.pdf"""
+
+    def __init__(self, root=JOB_DIR, retention_seconds=JOB_RETENTION_HOURS * 3600):
+        self.root = Path(root)
+        self.retention_seconds = retention_seconds
+
+    def _dir(self, job_id: str) -> Path:
+        return self.root / job_id
+
+    def save(self, job: Job):
+        job_dir = self._dir(job.id)
+        job_dir.mkdir(parents=True, exist_ok=True)
+        if job.pdf is not None and job.pdf_path is None:
+            pdf_path = job_dir / "report.pdf"
+            pdf_path.write_bytes(job.pdf)
+            job.pdf_path = str(pdf_path)
+        tmp = job_dir / "job.json.tmp"
+        tmp.write_text(json.dumps(job.to_dict(), ensure_ascii=False), encoding="utf-8")
+        tmp.replace(job_dir / "job.json")
+
+    def load(self, job_id: str):
+        """The stored job, or None. Jobs still queued/running on disk were cut off by a restart."""
+        path = self._dir(job_id) / "job.json"
+        if not job_id.isalnum() or not path.exists():
+            return None
+        job = Job.from_dict(json.loads(path.read_text(encoding="utf-8")))
+        if not job.is_finished:
+            job.state, job.error = FAILED, "Interrupted by a server restart. Please run the analysis again."
+        return job
+
+    def delete(self, job_id: str):
+        shutil.rmtree(self._dir(job_id), ignore_errors=True)
+
+    def prune(self, keep=()):
+        """Delete stored jobs older than the retention period, except the IDs in keep"""
+        if not self.root.exists():
+            return
+        cutoff = time.time() - self.retention_seconds
+        for job_dir in self.root.iterdir():
+            if job_dir.is_dir() and job_dir.name not in keep and job_dir.stat().st_mtime < cutoff:
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+
+# ---------------------------
+# Queue & workers
+# ---------------------------
+def content_digest(file_content) -> str:
+    """SHA-256 of the uploaded bytes (ParsedUpload and PdfExtraction carry theirs)"""
+    digest = getattr(file_content, "digest", None)
+    if digest:
+        return digest
+    if isinstance(file_content, io.BytesIO):
+        file_content = file_content.getvalue()
+    if isinstance(file_content, str):
+        file_content = file_content.encode("utf-8")
+    return hashlib.sha256(bytes(file_content)).hexdigest()
+
+
+def run_analysis(job: Job):
+    """Default worker body: the full chat_with_agents pipeline with progress, streaming and cancellation"""
+    from backend1_integration import build_index, chat_with_agents
+
+    query_engine = build_index(streaming=True)
+    return chat_with_agents(
+        file_type=job.file_type,
+        file_content=job.file_content,
+        query_engine=query_engine,
+        on_chunk=job.append,
+        on_progress=job.set_progress,
+        cancel_token=job.cancel_token,
+    )
+
+
+class JobQueue:
+    """
+    Bounded FIFO of jobs served by `workers` daemon threads (started on the first
+    submit). Analyses spend most of their time waiting on the model API, so
+    throughput grows with the worker count up to the API's rate limits.
+    Identical submissions (same upload bytes, analysis type and model) made while
+    one is queued or running join that job instead of starting another.
+    """
+
+    def __init__(self, runner=run_analysis, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, store=None,
+                 abandon_seconds=JOB_ABANDON_SECONDS):
+        self.runner = runner
+        self.abandon_seconds = abandon_seconds
+        self.workers = max(1, workers)
+        self.store = store or JobStore()
+        self._queue = queue.Queue(maxsize=max(1, max_queued))
+        self._jobs = {}
+        self._inflight = {}
+        self.coalesced = 0
+        self._threads = []
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"analysis-worker-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            watchdog = threading.Thread(target=self._watch_abandoned, name="analysis-watchdog", daemon=True)
+            watchdog.start()
+            self._threads.append(watchdog)
+
+    def submit(self, file_type: str, file_content, file_name=None, model=None, session_id=None) -> Job:
+        """
+        Queue an analysis for session_id and return its Job, or the in-flight Job
+        of an identical analysis; raises QueueFullError when the queue is full.
+        Sessions should keep calling attach() while they follow the job; callers
+        without a session_id never count as having left.
+        """
+        from backend1_integration import ANALYSIS_MODEL, CancellationToken
+
+        self._start()
+        self._maybe_prune()
+        key = (content_digest(file_content), file_type, model or ANALYSIS_MODEL)
+        seen = time.time() if session_id else math.inf
+        session_id = session_id or uuid.uuid4().hex
+        # Checked and registered under one lock so concurrent duplicates cannot both start
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is not None and not job.is_finished:
+                if session_id not in job.subscribers:
+                    self.coalesced += 1
+                    print(f"🔗 Identical {file_type} analysis joined job {job.id} ({len(job.subscribers) + 1} sessions)")
+                job.subscribers[session_id] = seen
+                return job
+
+            job = Job(file_type, file_content, file_name, key=key)
+            job.cancel_token = CancellationToken()
+            job.subscribers[session_id] = seen
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFullError(
+                    f"{self._queue.qsize()} analyses are already waiting. Please try again in a minute."
+                ) from None
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+            self._persist(job)
+        return job
+
+    def get(self, job_id: str):
+        """Job by ID: live from memory, or reloaded from disk (e.g. after a restart)"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job if job is not None else self.store.load(job_id)
+
+    def attach(self, job_id: str, session_id: str):
+        """
+        Heartbeat: session_id is (still) following the job. Called on every poll,
+        and when a refreshed tab reattaches.
+        """
+        job = self.get(job_id)
+        if job is None or job.is_finished:
+            return
+        with self._lock:
+            job.subscribers[session_id] = max(time.time(), job.subscribers.get(session_id, 0.0))
+
+    def cancel(self, job_id: str, session_id: str) -> bool:
+        """
+        Withdraw session_id from the job; the job stops once no session follows it.
+        Repeated calls for the same session have no further effect. Returns True
+        when this call stopped the job.
+        """
+        job = self.get(job_id)
+        if job is None or job.is_finished:
+            return False
+        with self._lock:
+            if session_id not in job.subscribers:
+                return False
+            del job.subscribers[session_id]
+            if job.subscribers:
+                return False
+        self._stop(job)
+        return True
+
+    def _stop(self, job: Job):
+        if job.cancel_token is not None:
+            job.cancel_token.cancel()
+        if job.state == QUEUED:
+            job.message = "Cancelling..."
+
+    def _watch_abandoned(self):
+        """Cancel jobs whose sessions have all stopped polling, so closed tabs stop spending API quota"""
+        while True:
+            time.sleep(max(1.0, self.abandon_seconds / 4))
+            cutoff = time.time() - self.abandon_seconds
+            with self._lock:
+                abandoned = [
+                    job for job in self._jobs.values()
+                    if not job.is_finished and job.subscribers and max(job.subscribers.values()) < cutoff
+                ]
+            for job in abandoned:
+                if not job.cancel_token.cancelled:
+                    print(f"🧹 No session has followed job {job.id} for {self.abandon_seconds:.0f}s; cancelling it")
+                    self._stop(job)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                # Never lose a worker thread; the job is reported as failed instead
+                print(f"❌ Worker error on job {job.id}: {e}")
+                job.state, job.error, job.finished = FAILED, str(e), time.time()
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job: Job):
+        from backend1_integration import AnalysisCancelled
+
+        if job.cancel_token.cancelled:
+            self._finish(job, CANCELLED, message="Cancelled before it started.")
+            return
+        job.state, job.started = RUNNING, time.time()
+        job.message = "Starting analysis..."
+        metrics.observe("job_wait", job.started - job.created, status="ok")
+        self._persist(job)
+        try:
+            result, pdf = self.runner(job)
+        except AnalysisCancelled:
+            self._finish(job, CANCELLED, message="Analysis cancelled.")
+        except Exception as e:
+            print(f"❌ Job {job.id} failed: {e}")
+            self._finish(job, FAILED, message="Analysis failed.", error=str(e))
+        else:
+            job.result, job.pdf = result, pdf
+            self._finish(job, DONE, message="Analysis complete!", progress=1.0)
+
+    def _finish(self, job: Job, state: str, message: str, error=None, progress=None):
+        job.state, job.message, job.error = state, message, error
+        job.finished = time.time()
+        if progress is not None:
+            job.progress = progress
+        job.file_content = None  # inputs can be large; only the results are kept
+        self._persist(job)
+        with self._lock:
+            if self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            finished = [j for j in self._jobs.values() if j.is_finished]
+            for old in sorted(finished, key=lambda j: j.finished)[:-MAX_FINISHED_IN_MEMORY]:
+                del self._jobs[old.id]
+        self._maybe_prune()
+
+    def _maybe_prune(self):
+        """Apply the retention period to stored jobs, at most every JOB_PRUNE_INTERVAL_SECONDS"""
+        with self._lock:
+            now = time.time()
+            if now - self._last_prune < JOB_PRUNE_INTERVAL_SECONDS:
+                return
+            self._last_prune = now
+            in_flight = {job.id for job in self._inflight.values()}
+        try:
+            self.store.prune(keep=in_flight)
+        except OSError as e:
+            print(f"⚠️ Could not prune stored jobs: {e}")
+
+    def _persist(self, job: Job):
+        try:
+            self.store.save(job)
+        except OSError as e:
+            print(f"⚠️ Could not persist job {job.id}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "queued": states.count(QUEUED),
+            "running": states.count(RUNNING),
+            "finished": sum(state in FINISHED_STATES for state in states),
+            "coalesced": self.coalesced,
+        }
+
+
+# Shared by every Streamlit session in the process
+job_queue = JobQueue()
+
+
+def _job_gauges() -> dict:
+    stats = job_queue.stats()
+    return {
+        "jobs_queued": stats["queued"],
+        "jobs_running": stats["running"],
+        "job_workers": stats["workers"],
+        "jobs_coalesced_total": stats["coalesced"],
+    }
+
+
+metrics.register_gauges(_job_gauges)
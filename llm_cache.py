@@ -0,0 +1,131 @@
+"""
+LLM Response Cache for InsightPilot
+(Content-addressed, on-disk cache so re-analysing the same file costs no API calls)
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+LLM_CACHE_DIR = Path(os.getenv("INSIGHTPILOT_LLM_CACHE_DIR", ".llm_cache"))
+LLM_CACHE_ENABLED = os.getenv("INSIGHTPILOT_LLM_CACHE", "1") != "0"
+LLM_CACHE_MAX_MB = float(os.getenv("INSIGHTPILOT_LLM_CACHE_MAX_MB", "200"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("INSIGHTPILOT_LLM_CACHE_TTL_HOURS", "168"))
+
+
+class ResponseCache:
+    """
+    SQLite-backed key/value store for model responses.
+    Entries expire after ttl_seconds, and the least recently used entries are
+    evicted once the stored text exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir=LLM_CACHE_DIR, max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024),
+                 ttl_seconds=LLM_CACHE_TTL_HOURS * 3600, enabled=LLM_CACHE_ENABLED):
+        self.path = Path(cache_dir) / "responses.sqlite"
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @staticmethod
+    def make_key(model: str, messages, **params) -> str:
+        """Stable hash of everything that determines a response"""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            sort_keys=True, ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connect(self):
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed)")
+        return self._conn
+
+    def get(self, key: str):
+        """Return the cached text for key, or None on a miss / expired entry"""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str):
+        if not self.enabled or value is None:
+            return
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(conn, now)
+            conn.commit()
+
+    def _evict(self, conn, now: float):
+        conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this process plus current on-disk usage"""
+        entries, size = 0, 0
+        if self.enabled:
+            with self._lock:
+                entries, size = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+                ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+
+# Shared by every stage in the process
+response_cache = ResponseCache()
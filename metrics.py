@@ -0,0 +1,215 @@
+"""
+Pipeline Metrics for InsightPilot
+(Per-stage latency spans, histograms aggregated across runs, and pluggable sinks:
+a structured JSON log and a Prometheus text-format file)
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Latency buckets in seconds (upper bounds; +Inf is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+METRICS_JSON_LOG = os.getenv("INSIGHTPILOT_METRICS_JSON_LOG")
+METRICS_PROM_FILE = os.getenv("INSIGHTPILOT_METRICS_PROM_FILE")
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Bucket upper bound holding the q-th observation (the last finite bound for +Inf)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+# ---------------------------
+# Sinks
+# ---------------------------
+class JsonLogSink:
+    """Appends one JSON object per finished span"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def on_span(self, event: dict):
+        line = json.dumps(event, default=str)
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def flush(self, registry):
+        pass
+
+
+class PrometheusTextSink:
+    """
+    Rewrites a Prometheus text-format file (e.g. for node_exporter's textfile
+    collector) with every histogram and gauge on each flush.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def on_span(self, event: dict):
+        pass
+
+    def flush(self, registry):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(registry.prometheus_text(), encoding="utf-8")
+        tmp.replace(self.path)
+
+
+# ---------------------------
+# Registry
+# ---------------------------
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+class MetricsRegistry:
+    """
+    Process-wide store of stage latency histograms, error counts and gauges.
+    Gauge collectors are callables returning {name: value}, read at export time
+    (cache hit ratios, index build time, ...).
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.errors = {}
+        self.sinks = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def register_gauges(self, collector):
+        self._collectors.append(collector)
+
+    def observe(self, stage: str, seconds: float, **fields):
+        with self._lock:
+            self.histograms.setdefault(stage, Histogram()).observe(seconds)
+            if fields.get("status") == "error":
+                self.errors[stage] = self.errors.get(stage, 0) + 1
+        event = {"ts": time.time(), "stage": stage, "seconds": round(seconds, 6), **fields}
+        for sink in self.sinks:
+            try:
+                sink.on_span(event)
+            except OSError as e:
+                print(f"⚠️ Metrics sink {type(sink).__name__} failed: {e}")
+
+    @contextmanager
+    def span(self, stage: str, **fields):
+        """Time a block as one observation of stage; failures are recorded with status=error"""
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, status=status, **fields)
+
+    @contextmanager
+    def run(self, stage: str, **fields):
+        """span() around a whole analysis; sinks are flushed when it ends"""
+        try:
+            with self.span(stage, **fields):
+                yield
+        finally:
+            self.flush()
+
+    def gauges(self) -> dict:
+        values = {}
+        for collector in self._collectors:
+            try:
+                values.update(collector())
+            except Exception as e:
+                print(f"⚠️ Metrics collector failed: {e}")
+        return {name: value for name, value in values.items() if value is not None}
+
+    def snapshot(self) -> dict:
+        """Per-stage count, errors, mean and p50/p95 (bucket bounds) plus current gauges"""
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": h.count,
+                    "errors": self.errors.get(stage, 0),
+                    "mean_seconds": h.sum / h.count if h.count else 0.0,
+                    "p50_seconds": h.quantile(0.5),
+                    "p95_seconds": h.quantile(0.95),
+                }
+                for stage, h in self.histograms.items()
+            }
+        return {"stages": stages, "gauges": self.gauges()}
+
+    def prometheus_text(self) -> str:
+        lines = [
+            "# HELP insightpilot_stage_seconds Latency of each analysis pipeline stage",
+            "# TYPE insightpilot_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f'insightpilot_stage_seconds_bucket{{stage="{_label(stage)}",le="{bound}"}} {cumulative}')
+                lines.append(f'insightpilot_stage_seconds_bucket{{stage="{_label(stage)}",le="+Inf"}} {h.count}')
+                lines.append(f'insightpilot_stage_seconds_sum{{stage="{_label(stage)}"}} {h.sum:.6f}')
+                lines.append(f'insightpilot_stage_seconds_count{{stage="{_label(stage)}"}} {h.count}')
+            errors = dict(self.errors)
+
+        lines += [
+            "# HELP insightpilot_stage_errors_total Stage runs that raised",
+            "# TYPE insightpilot_stage_errors_total counter",
+        ]
+        lines += [f'insightpilot_stage_errors_total{{stage="{_label(stage)}"}} {n}' for stage, n in sorted(errors.items())]
+
+        for name, value in sorted(self.gauges().items()):
+            lines.append(f"# TYPE insightpilot_{name} gauge")
+            lines.append(f"insightpilot_{name} {float(value):.6g}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """Push aggregated metrics to every sink (called at the end of each analysis)"""
+        for sink in self.sinks:
+            try:
+                sink.flush(self)
+            except OSError as e:
+                print(f"⚠️ Metrics sink {type(sink).__name__} failed: {e}")
+
+
+# Shared by every stage in the process
+metrics = MetricsRegistry()
+if METRICS_JSON_LOG:
+    metrics.add_sink(JsonLogSink(METRICS_JSON_LOG))
+if METRICS_PROM_FILE:
+    metrics.add_sink(PrometheusTextSink(METRICS_PROM_FILE))
+
+span = metrics.span
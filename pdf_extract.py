@@ -0,0 +1,438 @@
+"""
+PDF Text Extraction for InsightPilot
+(One in-memory extraction service: PDFs are opened straight from the upload bytes,
+and large documents are split into page ranges extracted in parallel processes)
+"""
+
+import hashlib
+import math
+import multiprocessing
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+
+from metrics import metrics
+
+# Separates pages in extracted text, so later stages can split on page boundaries
+PAGE_BREAK = "\f"
+
+PDF_WORKERS = int(os.getenv("INSIGHTPILOT_PDF_WORKERS", str(os.cpu_count() or 1)))
+# Smaller documents are extracted in-process: starting workers would cost more than it saves
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("INSIGHTPILOT_PDF_PARALLEL_MIN_PAGES", "64"))
+MIN_PAGES_PER_WORKER = 16
+PAGE_CACHE_MB = float(os.getenv("INSIGHTPILOT_PDF_PAGE_CACHE_MB", "64"))
+# Opt-in: detect tables and emit them as delimited rows instead of a flattened stream
+# of cells. Table detection costs far more than plain text extraction.
+PDF_TABLES = os.getenv("INSIGHTPILOT_PDF_TABLES", "0") == "1"
+TABLE_DELIMITER = "|"
+# A detected table is only kept when it looks like a real grid (see _is_grid)
+TABLE_MIN_ROWS = 3
+TABLE_MAX_CELL_CHARS = 40
+TABLE_MIN_SHORT_CELL_RATIO = 0.8
+_NUMERIC_CELL = re.compile(r"^[-+(]?[$€£]?[\d.,]+%?\)?$")
+
+# A line is boilerplate when it repeats on at least this share of pages (and on 3+ pages)
+BOILERPLATE_MIN_PAGE_RATIO = 0.5
+BOILERPLATE_MIN_PAGES = 3
+# Page numbers are only looked for among this many lines at the top and bottom of a page
+PAGE_NUMBER_EDGE_LINES = 2
+_PAGE_NUMBER_LINE = re.compile(r"^(?:page\s*)?(\d+)(?:\s*(?:of|/)\s*\d+)?$", re.IGNORECASE)
+_HAS_LETTER = re.compile(r"[^\W\d_]")
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+class PageText:
+    """
+    Text of one page; skipped pages have no text layer (image-only). When tables
+    were detected, text is the narrative outside them and tables holds each
+    table as delimited rows (header first).
+    """
+
+    def __init__(self, page_no: int, text: str, seconds: float, skipped=False, tables=()):
+        self.page_no = page_no
+        self.text = text
+        self.seconds = seconds
+        self.skipped = skipped
+        self.tables = list(tables)
+
+    def with_tables(self, text=None) -> str:
+        """text (default: the page narrative) followed by the page's tables"""
+        text = self.text if text is None else text
+        for k, rows in enumerate(self.tables, 1):
+            if text and not text.endswith("\n"):
+                text += "\n"
+            text += f"[Table {k}, header first]\n{rows}\n"
+        return text
+
+
+class PdfExtraction:
+    """
+    Per-page text of one PDF plus how long extraction took. text is the raw
+    extraction (narrative, then any tables); prompt_text has repeated
+    headers/footers/page numbers removed from the narrative and is what should
+    be sent to the model.
+    """
+
+    def __init__(self, pages: list, seconds: float, workers: int, cached_pages=0, digest=None):
+        self.pages = pages
+        self.digest = digest  # SHA-256 of the PDF bytes
+        self.seconds = seconds
+        self.workers = workers
+        self.cached_pages = cached_pages
+        self._prompt_pages = None
+        self._boilerplate_lines = 0
+
+    @property
+    def text(self) -> str:
+        """All page text, pages separated by PAGE_BREAK"""
+        return PAGE_BREAK.join(page.with_tables() for page in self.pages)
+
+    @property
+    def prompt_text(self) -> str:
+        if self._prompt_pages is None:
+            self._prompt_pages, self._boilerplate_lines = strip_boilerplate([page.text for page in self.pages])
+        return PAGE_BREAK.join(page.with_tables(text) for page, text in zip(self.pages, self._prompt_pages))
+
+    @property
+    def skipped_pages(self) -> int:
+        return sum(page.skipped for page in self.pages)
+
+    @property
+    def report(self) -> dict:
+        prompt_chars = len(self.prompt_text)
+        return {
+            "pages": len(self.pages),
+            "skipped_pages": self.skipped_pages,
+            "tables": sum(len(page.tables) for page in self.pages),
+            "cached_pages": self.cached_pages,
+            "workers": self.workers,
+            "seconds": self.seconds,
+            "slowest_page_seconds": max((page.seconds for page in self.pages), default=0.0),
+            "boilerplate_lines_removed": self._boilerplate_lines,
+            "raw_chars": len(self.text),
+            "prompt_chars": prompt_chars,
+        }
+
+
+# ---------------------------
+# Page cache
+# ---------------------------
+class PageTextCache:
+    """
+    In-memory LRU of extracted page text keyed by a hash of the page's content
+    (content stream, Form XObjects, fonts and size), so re-uploading a report, or
+    a new export sharing pages with an old one, skips extraction for those pages.
+    """
+
+    def __init__(self, max_bytes=int(PAGE_CACHE_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def keys(self) -> frozenset:
+        """Snapshot of the cached keys (sent to extraction workers)"""
+        with self._lock:
+            return frozenset(self._entries)
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def get(self, key: str):
+        """(text, tables) for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    @staticmethod
+    def _entry_size(entry) -> int:
+        text, tables = entry
+        return len(text) + sum(len(rows) for rows in tables)
+
+    def put(self, key: str, text: str, tables=()):
+        with self._lock:
+            if key in self._entries:
+                return
+            entry = (text, tuple(tables))
+            self._entries[key] = entry
+            self._size += self._entry_size(entry)
+            while self._size > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._entry_size(evicted)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "chars": self._size,
+        }
+
+
+page_cache = PageTextCache()
+
+
+def _page_key(doc, page, tables: bool) -> str:
+    digest = hashlib.sha256(b"tables:" if tables else b"text:")
+    digest.update(page.read_contents())
+    digest.update(repr(tuple(page.rect)).encode())
+    for font in page.get_fonts():
+        digest.update(f"{font[3]}|{font[5]}".encode())
+    for xobject in page.get_xobjects():
+        digest.update(doc.xref_stream_raw(xobject[0]) or b"")
+    return digest.hexdigest()
+
+
+# ---------------------------
+# Boilerplate stripping
+# ---------------------------
+def _page_number_lines(lines: list, page_no: int) -> dict:
+    """
+    {index: bare} for lines at the top or bottom of a page (PAGE_NUMBER_EDGE_LINES
+    non-empty lines each way) that read as page_no: "7" (bare) or "Page 7 of 20"
+    """
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    found = {}
+    for i in filled[:PAGE_NUMBER_EDGE_LINES] + filled[-PAGE_NUMBER_EDGE_LINES:]:
+        number = _PAGE_NUMBER_LINE.match(lines[i].strip())
+        if number and int(number.group(1)) == page_no:
+            found[i] = number.group(0).isdigit()
+    return found
+
+
+def strip_boilerplate(pages: list):
+    """
+    Drop lines repeated across pages (report titles, slicer captions, footers):
+    a line with letters in it found on at least BOILERPLATE_MIN_PAGE_RATIO of the
+    pages is kept only where it first appears. Page-number lines at the top or
+    bottom of a page are removed: labelled ones ("Page 7 of 20") always, bare
+    ones ("7" on page 7) only when most pages carry one, so a KPI value that
+    happens to equal its page number is kept.
+    Returns (pages, removed_line_count).
+    """
+    page_lines = [text.splitlines() for text in pages]
+    text_pages = sum(1 for lines in page_lines if lines)
+    threshold = max(BOILERPLATE_MIN_PAGES, math.ceil(BOILERPLATE_MIN_PAGE_RATIO * text_pages))
+    counts = Counter(
+        line for lines in page_lines for line in {line.strip() for line in lines if line.strip()}
+    )
+    repeated = {line for line, n in counts.items() if n >= threshold and _HAS_LETTER.search(line)}
+    numbers = [_page_number_lines(lines, page_no) for page_no, lines in enumerate(page_lines, 1)]
+    numbered_pages = sum(any(found.values()) for found in numbers)
+    drop_bare = numbered_pages >= threshold
+
+    seen = set()
+    removed = 0
+    stripped = []
+    for lines, found in zip(page_lines, numbers):
+        kept = []
+        for i, line in enumerate(lines):
+            key = line.strip()
+            page_number = i in found and (drop_bare or not found[i])
+            if page_number or (key in repeated and key in seen):
+                removed += 1
+                continue
+            if key in repeated:
+                seen.add(key)
+            kept.append(line)
+        stripped.append("\n".join(kept) + "\n" if kept else "")
+    return stripped, removed
+
+
+# ---------------------------
+# Extraction
+# ---------------------------
+def _has_text_layer(page) -> bool:
+    """Pages without any font resources are scans/images and have nothing to extract"""
+    return bool(page.get_fonts())
+
+
+def _cell(value) -> str:
+    return "" if value is None else " ".join(str(value).replace(TABLE_DELIMITER, "/").split())
+
+
+def _table_rows(table) -> str:
+    """One delimited line per non-empty row, header first"""
+    rows = table.extract()
+    if not table.header.external and rows:
+        rows = rows[1:]  # the header is the table's own first row
+    header = [_cell(name) or f"col{i + 1}" for i, name in enumerate(table.header.names)]
+    lines = [TABLE_DELIMITER.join(header)]
+    for row in rows:
+        cells = [_cell(value) for value in row]
+        if any(cells):
+            lines.append(TABLE_DELIMITER.join(cells))
+    return "\n".join(lines)
+
+
+def _is_grid(page, table) -> bool:
+    """
+    True for a real table: several rows and columns of mostly short or numeric
+    cells, with every word inside it kept whole. Layout boxes around prose fail
+    this (long cells, words cut at cell edges) and stay as plain text.
+    """
+    rows = table.extract()
+    if len(rows) < TABLE_MIN_ROWS or table.col_count < 2:
+        return False
+    cells = [_cell(value) for row in rows for value in row]
+    cells = [cell for cell in cells if cell]
+    if not cells:
+        return False
+    short = sum(len(cell) <= TABLE_MAX_CELL_CHARS or bool(_NUMERIC_CELL.match(cell)) for cell in cells)
+    if short < TABLE_MIN_SHORT_CELL_RATIO * len(cells):
+        return False
+    tokens = set(" ".join(cells).split())
+    words = {word[4].replace(TABLE_DELIMITER, "/") for word in page.get_text("words", clip=table.bbox)}
+    return not words - tokens
+
+
+def _page_content(page, tables: bool):
+    """
+    (narrative text, [table rows]); narrative leaves out text blocks inside a
+    table. A table is kept when it is a real grid and its delimited rows are no
+    longer than the flattened cell text they replace; with none kept, the page
+    is plain get_text().
+    """
+    text = page.get_text()
+    if not tables:
+        return text, []
+    found = []
+    for table in page.find_tables().tables:
+        if _is_grid(page, table):
+            rows = _table_rows(table)
+            if len(rows) <= len(page.get_text(clip=table.bbox)):
+                found.append((fitz.Rect(table.bbox), rows))
+    if not found:
+        return text, []
+
+    boxes = [box for box, _ in found]
+    narrative = "".join(
+        block[4] for block in page.get_text("blocks")
+        if block[6] == 0 and not any(
+            box.contains(fitz.Point((block[0] + block[2]) / 2, (block[1] + block[3]) / 2)) for box in boxes
+        )
+    )
+    return narrative, [rows for _, rows in found]
+
+
+def _extract_pages(data: bytes, page_numbers: list, tables=PDF_TABLES, known_keys=None) -> list:
+    """
+    (page_no, text, seconds, skipped, tables, key) for each of page_numbers; runs
+    in worker processes. With known_keys (the page cache's keys) every page's key
+    is computed here, and pages already cached come back with text None instead
+    of being extracted.
+    """
+    results = []
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        for page_no in page_numbers:
+            started = time.perf_counter()
+            page = doc.load_page(page_no)
+            if not _has_text_layer(page):
+                results.append((page_no, "", time.perf_counter() - started, True, [], None))
+                continue
+            key = _page_key(doc, page, tables) if known_keys is not None else None
+            if key is not None and key in known_keys:
+                results.append((page_no, None, time.perf_counter() - started, False, [], key))
+                continue
+            text, page_tables = _page_content(page, tables)
+            results.append((page_no, text, time.perf_counter() - started, False, page_tables, key))
+    return results
+
+
+def _get_pool(workers: int):
+    """Process pool shared across extractions ('spawn' so the host's threads are never forked)"""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers < workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _split(page_numbers: list, parts: int):
+    size = math.ceil(len(page_numbers) / parts)
+    return [page_numbers[start:start + size] for start in range(0, len(page_numbers), size)]
+
+
+def extract_pdf(data, workers=None, cache=page_cache, tables=PDF_TABLES) -> PdfExtraction:
+    """
+    Extract every page of a PDF given as bytes. Pages already in the page cache
+    are reused; when at least PDF_PARALLEL_MIN_PAGES pages remain they are split
+    into contiguous runs, one per worker process. If the pool cannot be used,
+    extraction falls back to this process. cache=None disables the page cache;
+    tables=True detects tables and keeps them as delimited rows.
+    """
+    started = time.perf_counter()
+    data = bytes(data)
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        todo = list(range(doc.page_count))
+    # Page keys are computed by whichever process extracts the page, never in a serial prepass
+    known_keys = cache.keys() if cache is not None else None
+
+    workers = max(1, min(workers or PDF_WORKERS, math.ceil(len(todo) / MIN_PAGES_PER_WORKER)))
+    rows = None
+    if len(todo) >= PDF_PARALLEL_MIN_PAGES and workers > 1:
+        try:
+            pool = _get_pool(workers)
+            futures = [pool.submit(_extract_pages, data, part, tables, known_keys) for part in _split(todo, workers)]
+            rows = [row for future in futures for row in future.result()]
+        except (BrokenProcessPool, OSError) as e:
+            print(f"⚠️ Parallel PDF extraction unavailable ({e}); extracting in-process...")
+            _reset_pool()
+    if rows is None:
+        workers = 1
+        rows = _extract_pages(data, todo, tables, known_keys) if todo else []
+
+    pages, evicted = {}, []
+    for page_no, text, page_seconds, skipped, page_tables, key in rows:
+        if text is None:
+            entry = cache.get(key)
+            if entry is None:
+                evicted.append(page_no)  # dropped from the cache since known_keys was taken
+                continue
+            text, page_tables = entry
+        elif key is not None:
+            cache.miss()
+            cache.put(key, text, page_tables)
+        pages[page_no] = PageText(page_no, text, page_seconds, skipped=skipped, tables=page_tables)
+    if evicted:
+        for page_no, text, page_seconds, skipped, page_tables, key in _extract_pages(data, evicted, tables, frozenset()):
+            cache.put(key, text, page_tables)
+            pages[page_no] = PageText(page_no, text, page_seconds, skipped=skipped, tables=page_tables)
+    cached_pages = sum(text is None for _, text, *_ in rows) - len(evicted)
+
+    ordered = [pages[page_no] for page_no in sorted(pages)]
+    seconds = time.perf_counter() - started
+    metrics.observe("pdf_extract", seconds, status="ok", pages=len(ordered), cached_pages=cached_pages,
+                    workers=workers)
+    return PdfExtraction(ordered, seconds=seconds, workers=workers, cached_pages=cached_pages,
+                         digest=hashlib.sha256(data).hexdigest())
@@ -0,0 +1,279 @@
+"""
+Column Profiling for InsightPilot
+(Vectorized per-column statistics that give describe_dataset more than dtypes and 3 rows)
+"""
+
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from sketches import CountMinSketch, HyperLogLog, TDigest
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.0
+    guess_datetime_format = None
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+TOP_K = 5
+DATE_SAMPLE_SIZE = 1000
+# Share of sampled values that must parse as dates before a text column is treated as one
+DATE_MIN_PARSE_RATIO = 0.9
+PROFILE_MAX_CHARS = 4000
+# Frames longer than this are profiled with fixed-memory sketches (see sketches.py)
+SKETCH_ROW_THRESHOLD = int(os.getenv("INSIGHTPILOT_SKETCH_ROW_THRESHOLD", "5000000"))
+SKETCH_CHUNK_ROWS = 1_000_000
+
+
+# ---------------------------
+# Profiling
+# ---------------------------
+def _parse_dates(col: pd.Series, fmt):
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return pd.to_datetime(col, format=fmt, errors="coerce")
+
+
+def _date_format(col: pd.Series):
+    """(looks_like_dates, strptime format or None) judged from a sample of col"""
+    sample = col.dropna()
+    if sample.empty:
+        return False, None
+    sample = sample.sample(min(len(sample), DATE_SAMPLE_SIZE), random_state=0).astype(str)
+    if not sample.str.contains(r"\d").all():
+        return False, None
+
+    fmt = guess_datetime_format(sample.iloc[0]) if guess_datetime_format else None
+    return _parse_dates(sample, fmt).notna().mean() >= DATE_MIN_PARSE_RATIO, fmt
+
+
+def _detect_dates(col: pd.Series):
+    """
+    Parse a text column as datetimes if a sample of it looks like dates, else None.
+    Categorical columns only parse their categories, which span the same range.
+    """
+    if col.dtype == "category":
+        col = pd.Series(col.cat.categories)
+    is_date, fmt = _date_format(col)
+    return _parse_dates(col, fmt) if is_date else None
+
+
+def _scalar(value):
+    """numpy scalar -> plain Python value"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def profile_dataframe(df: pd.DataFrame, top_k=TOP_K, approximate=None) -> list:
+    """
+    Per-column statistics computed with whole-frame vectorized calls:
+    dtype, null rate, distinct count, min/max, quantiles (numeric), top-k values
+    (text/categorical/bool) and date ranges (datetime or date-like text).
+    approximate=True (default: above SKETCH_ROW_THRESHOLD rows) uses SketchProfiler.
+    """
+    rows = len(df)
+    if approximate is None:
+        approximate = rows > SKETCH_ROW_THRESHOLD
+    if approximate:
+        profiler = SketchProfiler()
+        for start in range(0, rows, SKETCH_CHUNK_ROWS):
+            profiler.update(df.iloc[start:start + SKETCH_CHUNK_ROWS])
+        return profiler.profiles(top_k=top_k)
+
+    null_rate = df.isna().mean() if rows else pd.Series(0.0, index=df.columns)
+    distinct = df.nunique(dropna=True)
+
+    numeric = df.select_dtypes(include="number").select_dtypes(exclude="bool")
+    if len(numeric.columns) and rows:
+        quantiles = numeric.quantile(list(QUANTILES))
+        mins, maxs = numeric.min(), numeric.max()
+
+    profiles = []
+    for i, name in enumerate(df.columns):
+        col = df.iloc[:, i]
+        profile = {
+            "column": str(name),
+            "dtype": str(col.dtype),
+            "null_rate": float(null_rate.iloc[i]),
+            "distinct": int(distinct.iloc[i]),
+        }
+
+        if name in numeric.columns and rows:
+            profile["min"] = _scalar(mins[name])
+            profile["max"] = _scalar(maxs[name])
+            profile["quantiles"] = {f"p{int(q * 100)}": float(quantiles.at[q, name]) for q in QUANTILES}
+        else:
+            dates = col if pd.api.types.is_datetime64_any_dtype(col) else None
+            if dates is None and col.dtype.kind == "O":  # object text and category
+                dates = _detect_dates(col)
+            if dates is not None and dates.notna().any():
+                profile["date_range"] = (str(dates.min().date()), str(dates.max().date()))
+            elif profile["distinct"] < rows:
+                # Skip id-like columns where every value is unique
+                top = col.value_counts(dropna=True).head(top_k)
+                profile["top_values"] = {str(k): int(v) for k, v in top.items()}
+        profiles.append(profile)
+    return profiles
+
+
+# ---------------------------
+# Sketch-based profiling
+# ---------------------------
+class _ColumnSketch:
+    """Fixed-memory summary of one column; kind is fixed by the first non-empty chunk"""
+
+    def __init__(self):
+        self.kind = None
+        self.dtype = None
+        self.count = 0
+        self.nulls = 0
+        self.distinct = HyperLogLog()
+        self.digest = TDigest()
+        self.frequent = CountMinSketch()
+        self.date_format = None
+        self.date_min = None
+        self.date_max = None
+
+    def _classify(self, values: pd.Series):
+        self.dtype = str(values.dtype)
+        if pd.api.types.is_bool_dtype(values):
+            self.kind = "text"
+        elif pd.api.types.is_numeric_dtype(values):
+            self.kind = "numeric"
+        elif pd.api.types.is_datetime64_any_dtype(values):
+            self.kind = "date"
+        elif pd.to_numeric(values, errors="coerce").notna().all():
+            # All-text chunks (e.g. csv_ingest's dtype=str reader) holding numbers
+            self.kind, self.dtype = "numeric", "numeric"
+        else:
+            is_date, self.date_format = _date_format(values)
+            self.kind = "date" if is_date else "text"
+            self.dtype = "date" if is_date else "text"
+
+    def update(self, col: pd.Series):
+        self.count += len(col)
+        values = col.dropna()
+        self.nulls += len(col) - len(values)
+        if values.empty:
+            return
+        if self.kind is None:
+            self._classify(values)
+
+        self.distinct.update(values)
+        if self.kind == "numeric":
+            self.digest.update(pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan))
+        elif self.kind == "date":
+            dates = values if pd.api.types.is_datetime64_any_dtype(values) else _parse_dates(values, self.date_format)
+            self._merge_dates(dates.min(), dates.max())
+        else:
+            self.frequent.update(values.astype(str) if values.dtype == "category" else values)
+
+    def _merge_dates(self, lo, hi):
+        if pd.notna(lo):
+            self.date_min = lo if self.date_min is None else min(self.date_min, lo)
+        if pd.notna(hi):
+            self.date_max = hi if self.date_max is None else max(self.date_max, hi)
+
+    def merge(self, other: "_ColumnSketch"):
+        self.count += other.count
+        self.nulls += other.nulls
+        if self.kind is None:
+            self.kind, self.dtype, self.date_format = other.kind, other.dtype, other.date_format
+        self.distinct.merge(other.distinct)
+        self.digest.merge(other.digest)
+        self.frequent.merge(other.frequent)
+        self._merge_dates(other.date_min, other.date_max)
+        return self
+
+
+class SketchProfiler:
+    """
+    Approximate, fixed-memory column profiler. Feed it DataFrame chunks with
+    update(); profilers built on separate chunks (or threads/processes) combine
+    with merge(). Error bounds are those of sketches.py: distinct counts ~0.8%,
+    quantile rank error < ~0.5%, top-value counts over by at most ~0.13% of rows.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = {}
+
+    def update(self, chunk: pd.DataFrame):
+        self.rows += len(chunk)
+        for i, name in enumerate(chunk.columns):
+            self.columns.setdefault(name, _ColumnSketch()).update(chunk.iloc[:, i])
+        return self
+
+    def merge(self, other: "SketchProfiler"):
+        self.rows += other.rows
+        for name, sketch in other.columns.items():
+            if name in self.columns:
+                self.columns[name].merge(sketch)
+            else:
+                self.columns[name] = sketch
+        return self
+
+    def profiles(self, top_k=TOP_K) -> list:
+        """Same shape as profile_dataframe(); all-empty columns are left out"""
+        profiles = []
+        for name, sketch in self.columns.items():
+            if sketch.kind is None:
+                continue
+            distinct = min(sketch.distinct.estimate(), sketch.count - sketch.nulls)
+            profile = {
+                "column": str(name).strip(),
+                "dtype": sketch.dtype,
+                "null_rate": sketch.nulls / sketch.count if sketch.count else 0.0,
+                "distinct": distinct,
+                "approximate": True,
+            }
+            if sketch.kind == "numeric" and sketch.digest.count:
+                profile["min"] = sketch.digest.min
+                profile["max"] = sketch.digest.max
+                profile["quantiles"] = {f"p{int(q * 100)}": sketch.digest.quantile(q) for q in QUANTILES}
+            elif sketch.kind == "date" and sketch.date_min is not None:
+                profile["date_range"] = (str(sketch.date_min.date()), str(sketch.date_max.date()))
+            elif sketch.kind == "text" and distinct < 0.99 * (sketch.count - sketch.nulls):
+                profile["top_values"] = {str(k): v for k, v in sketch.frequent.heavy_hitters(top_k).items()}
+            profiles.append(profile)
+        return profiles
+
+
+# ---------------------------
+# Prompt formatting
+# ---------------------------
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    text = str(value)
+    return text if len(text) <= 30 else text[:27] + "..."
+
+
+def format_profile(profiles: list, max_chars=PROFILE_MAX_CHARS) -> str:
+    """One compact line per column, cut off at max_chars so the prompt stays bounded"""
+    lines = []
+    used = 0
+    for n, p in enumerate(profiles):
+        approx = "≈" if p.get("approximate") else ""
+        parts = [f"{p['column']} ({p['dtype']})", f"nulls {p['null_rate']:.1%}", f"distinct {approx}{p['distinct']:,}"]
+        if "quantiles" in p:
+            q = p["quantiles"]
+            parts.append(f"min {_fmt(p['min'])} / median {_fmt(q['p50'])} / max {_fmt(p['max'])}")
+            parts.append(f"p5–p95 {_fmt(q['p5'])}–{_fmt(q['p95'])}")
+        if "date_range" in p:
+            parts.append(f"dates {p['date_range'][0]} → {p['date_range'][1]}")
+        if "top_values" in p:
+            parts.append("top: " + ", ".join(f"{_fmt(k)} ({approx}{v:,})" for k, v in p["top_values"].items()))
+        line = "- " + "; ".join(parts)
+
+        if used + len(line) > max_chars:
+            lines.append(f"- ... {len(profiles) - n} more columns not shown")
+            break
+        lines.append(line)
+        used += len(line) + 1
+    return "\n".join(lines)
+
+
+def summarize_profile(df: pd.DataFrame, max_chars=PROFILE_MAX_CHARS, approximate=None) -> str:
+    return format_profile(profile_dataframe(df, approximate=approximate), max_chars=max_chars)
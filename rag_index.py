@@ -0,0 +1,269 @@
+"""
+RAG Index Storage for InsightPilot
+(Persists the ./data vector index and keeps it in sync with a per-document manifest,
+so only added or modified guidance is ever re-embedded)
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import fitz  # PyMuPDF
+from llama_index.core import (
+    Document,
+    Settings,
+    SimpleDirectoryReader,
+    StorageContext,
+    VectorStoreIndex,
+    load_index_from_storage,
+)
+from llama_index.core.schema import MetadataMode
+
+DATA_DIR = Path("data")
+INDEX_CACHE_DIR = Path(os.getenv("INSIGHTPILOT_INDEX_CACHE", ".index_cache"))
+MANIFEST_NAME = "manifest.json"
+
+# Ingestion tuning: chunks per embedding request, and how many requests may be in
+# flight at once (peak memory is roughly (concurrency + 1) * batch_size chunks)
+EMBED_BATCH_SIZE = int(os.getenv("INSIGHTPILOT_EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.getenv("INSIGHTPILOT_EMBED_CONCURRENCY", "4"))
+
+
+# ---------------------------
+# Manifest
+# ---------------------------
+def _file_digest(path: Path) -> str:
+    """SHA-256 of a file, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _data_files(data_dir: Path):
+    """Files SimpleDirectoryReader would load (top level, no hidden files)"""
+    return sorted(
+        p for p in Path(data_dir).iterdir()
+        if p.is_file() and not p.name.startswith(".")
+    )
+
+
+def scan_documents(data_dir: Path, previous: dict) -> dict:
+    """
+    Describe every file in data_dir as {name: {path, size, mtime, sha256}}.
+    Files whose size and mtime match the previous manifest keep their old hash,
+    so an unchanged corpus is never read back from disk.
+    """
+    entries = {}
+    for path in _data_files(data_dir):
+        stat = path.stat()
+        old = previous.get(path.name)
+        if old and old["size"] == stat.st_size and old["mtime"] == stat.st_mtime:
+            sha256 = old["sha256"]
+        else:
+            sha256 = _file_digest(path)
+        entries[path.name] = {
+            "path": str(path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": sha256,
+        }
+    return entries
+
+
+def diff_manifests(previous: dict, current: dict):
+    """Return (added, modified, removed) document names"""
+    added = sorted(set(current) - set(previous))
+    removed = sorted(set(previous) - set(current))
+    modified = sorted(
+        name for name in set(current) & set(previous)
+        if current[name]["sha256"] != previous[name]["sha256"]
+    )
+    return added, modified, removed
+
+
+def _read_manifest(persist_dir: Path) -> dict:
+    try:
+        with open(persist_dir / MANIFEST_NAME, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def read_corpus_version(cache_dir=INDEX_CACHE_DIR):
+    """Short hash of the stored index (embedding model + document hashes), or None"""
+    manifest = _read_manifest(Path(cache_dir) / "index")
+    if not manifest:
+        return None
+    digest = hashlib.sha256(manifest["embed_model"].encode())
+    for name, entry in sorted(manifest["documents"].items()):
+        digest.update(f"{name}:{entry['sha256']}".encode())
+    return digest.hexdigest()[:16]
+
+
+# ---------------------------
+# Streaming ingestion
+# ---------------------------
+def iter_documents(path: Path):
+    """
+    Yield the Documents of one file. PDFs are streamed page by page (ids match
+    SimpleDirectoryReader's filename_as_id scheme); other formats go through
+    SimpleDirectoryReader as before.
+    """
+    path = Path(path)
+    if path.suffix.lower() != ".pdf":
+        yield from SimpleDirectoryReader(input_files=[str(path)], filename_as_id=True).load_data()
+        return
+
+    with fitz.open(path) as pdf:
+        for page_no, page in enumerate(pdf):
+            text = page.get_text()
+            if not text.strip():
+                continue
+            yield Document(
+                id_=f"{path}_part_{page_no}",
+                text=text,
+                metadata={"page_label": str(page_no + 1), "file_name": path.name},
+            )
+
+
+def _iter_node_batches(documents, node_parser, batch_size: int):
+    """Chunk a document stream into lists of at most batch_size nodes"""
+    pending = []
+    for doc in documents:
+        pending.extend(node_parser.get_nodes_from_documents([doc]))
+        while len(pending) >= batch_size:
+            yield pending[:batch_size]
+            pending = pending[batch_size:]
+    if pending:
+        yield pending
+
+
+def _embed_batch(embed_model, nodes):
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    for node, embedding in zip(nodes, embed_model.get_text_embedding_batch(texts)):
+        node.embedding = embedding
+    return nodes
+
+
+def ingest_documents(index, documents, embed_model,
+                     batch_size=EMBED_BATCH_SIZE, concurrency=EMBED_CONCURRENCY) -> int:
+    """
+    Chunk, embed and insert a document stream into index. At most `concurrency`
+    embedding requests run at once; parsing pauses until one of them finishes,
+    so memory stays bounded however large the corpus is. Returns the chunk count.
+    """
+    node_parser = Settings.node_parser
+    in_flight = set()
+    chunk_count = 0
+
+    def _drain(done):
+        nonlocal chunk_count
+        for future in done:
+            nodes = future.result()
+            index.insert_nodes(nodes)
+            chunk_count += len(nodes)
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as pool:
+        for batch in _iter_node_batches(documents, node_parser, batch_size):
+            if len(in_flight) >= concurrency:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                _drain(done)
+            in_flight.add(pool.submit(_embed_batch, embed_model, batch))
+        _drain(wait(in_flight).done)
+
+    return chunk_count
+
+
+# ---------------------------
+# Load / sync
+# ---------------------------
+def _load_index(persist_dir: Path, embed_model):
+    try:
+        storage_context = StorageContext.from_defaults(persist_dir=str(persist_dir))
+        return load_index_from_storage(storage_context, embed_model=embed_model)
+    except Exception as e:
+        print(f"⚠️ Stored RAG index is unreadable ({e}); rebuilding...")
+        return None
+
+
+def _persist(index, manifest: dict, persist_dir: Path):
+    """Write index + manifest to a scratch dir, then swap it in place"""
+    tmp_dir = persist_dir.with_name(f".{persist_dir.name}.tmp")
+    old_dir = persist_dir.with_name(f".{persist_dir.name}.old")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+    index.storage_context.persist(persist_dir=str(tmp_dir))
+    with open(tmp_dir / MANIFEST_NAME, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    if persist_dir.exists():
+        persist_dir.rename(old_dir)
+    tmp_dir.rename(persist_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def load_or_build_index(embed_model, data_dir=DATA_DIR, cache_dir=INDEX_CACHE_DIR):
+    """
+    Return the index for data_dir. The stored index is reused as-is when nothing
+    changed; otherwise only added/modified documents are parsed and embedded and
+    the nodes of modified/removed documents are deleted.
+    """
+    data_dir, cache_dir = Path(data_dir), Path(cache_dir)
+    persist_dir = cache_dir / "index"
+
+    manifest = _read_manifest(persist_dir)
+    index = None
+    if manifest.get("embed_model") == embed_model.model_name:
+        index = _load_index(persist_dir, embed_model)
+    if index is None:
+        manifest = {"embed_model": embed_model.model_name, "documents": {}}
+        index = VectorStoreIndex(nodes=[], embed_model=embed_model)
+
+    previous = manifest["documents"]
+    current = scan_documents(data_dir, previous)
+    added, modified, removed = diff_manifests(previous, current)
+
+    for name in current:
+        if name in previous and name not in modified:
+            current[name]["doc_ids"] = previous[name]["doc_ids"]
+
+    if not (added or modified or removed):
+        if current != previous:
+            # Only mtimes moved (e.g. a fresh checkout) – remember them to skip re-hashing
+            _persist(index, {**manifest, "documents": current}, persist_dir)
+        print(f"⚡ Loaded RAG index from {persist_dir} ({len(current)} documents, no changes)")
+        return index
+
+    for name in modified + removed:
+        for doc_id in previous[name]["doc_ids"]:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+
+    started = time.perf_counter()
+    chunk_count = 0
+    for name in added + modified:
+        doc_ids = []
+
+        def _tracked(documents):
+            for doc in documents:
+                doc_ids.append(doc.id_)
+                yield doc
+
+        chunk_count += ingest_documents(index, _tracked(iter_documents(current[name]["path"])), embed_model)
+        current[name]["doc_ids"] = doc_ids
+    elapsed = time.perf_counter() - started
+
+    _persist(index, {**manifest, "documents": current}, persist_dir)
+    print(
+        f"✅ RAG index synced: {len(added)} added, {len(modified)} modified, "
+        f"{len(removed)} removed ({len(current)} documents total)"
+    )
+    if chunk_count:
+        print(f"📈 Embedded {chunk_count} chunks in {elapsed:.1f}s ({chunk_count / elapsed:.1f} chunks/sec)")
+    return index
@@ -0,0 +1,202 @@
+"""
+Approximate Sketches for InsightPilot
+(Fixed-memory, mergeable summaries for profiling datasets too big for exact stats)
+
+Error bounds with the default parameters:
+- HyperLogLog (p=14, 16 KB): distinct counts within ~0.8% (1.04/sqrt(2^p)) standard error
+- TDigest (compression=200): quantile rank error typically < 0.5% near the median and
+  far smaller in the tails; min/max are exact
+- CountMinSketch (width=2048, depth=5, 80 KB): counts never under-estimate and
+  over-estimate by at most e/width ≈ 0.13% of all values with probability 1 - e^-depth ≈ 99.3%
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+_U64 = np.uint64
+
+
+def hash_values(values) -> np.ndarray:
+    """64-bit hashes of any array-like (numbers, strings, mixed objects)"""
+    arr = values.to_numpy() if isinstance(values, (pd.Series, pd.Index)) else np.asarray(values)
+    if arr.dtype.kind not in "biufcmM":
+        arr = arr.astype(object)
+    return pd.util.hash_array(arr)
+
+
+# ---------------------------
+# HyperLogLog (cardinality)
+# ---------------------------
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    """Exact bit length of each uint64 (0 for 0)"""
+    x = x.copy()
+    n = np.zeros(x.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        big = x >= (_U64(1) << _U64(shift))
+        n[big] += shift
+        x[big] >>= _U64(shift)
+    return n + (x > 0)
+
+
+class HyperLogLog:
+    def __init__(self, p=14):
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def update_hashes(self, hashes: np.ndarray):
+        if not len(hashes):
+            return
+        idx = (hashes >> _U64(64 - self.p)).astype(np.int64)
+        rest = hashes & _U64((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - _bit_length(rest) + 1
+        np.maximum.at(self.registers, idx, rank.astype(np.uint8))
+
+    def update(self, values):
+        self.update_hashes(hash_values(values))
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m * self.m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * self.m and zeros:
+            return int(round(self.m * math.log(self.m / zeros)))  # linear counting
+        return int(round(raw))
+
+
+# ---------------------------
+# t-digest (quantiles)
+# ---------------------------
+class TDigest:
+    """
+    Merging t-digest with the k1 (arcsine) scale function. Each update sorts the
+    new values together with the existing centroids and regroups them so that no
+    centroid spans more than one unit of k, giving at most ~compression centroids.
+    """
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = math.inf
+        self.max = -math.inf
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind="mergesort")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        q_left = (np.cumsum(weights) - weights) / total
+        k = self.compression / (2 * math.pi) * np.arcsin(2 * q_left - 1)
+        bucket = np.floor(k - k[0]).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        w = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / w
+        self.weights = w
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self._compress(np.concatenate([self.means, values]),
+                       np.concatenate([self.weights, np.ones(len(values))]))
+
+    def merge(self, other: "TDigest"):
+        if len(other.weights):
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._compress(np.concatenate([self.means, other.means]),
+                           np.concatenate([self.weights, other.weights]))
+        return self
+
+    def quantile(self, q: float) -> float:
+        if not len(self.weights):
+            return math.nan
+        total = self.weights.sum()
+        centers = (np.cumsum(self.weights) - self.weights / 2) / total
+        xs = np.r_[0.0, centers, 1.0]
+        ys = np.r_[self.min, self.means, self.max]
+        return float(np.interp(q, xs, ys))
+
+
+# ---------------------------
+# Count-min sketch (heavy hitters)
+# ---------------------------
+class CountMinSketch:
+    """
+    Count-min sketch plus a bounded candidate list, so the most frequent values
+    can be reported (not just queried).
+    """
+
+    _SEEDS = np.array([0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9,
+                       0xD6E8FEB86659FD93, 0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53,
+                       0x2545F4914F6CDD1D, 0x94D049BB133111EB], dtype=np.uint64)
+
+    def __init__(self, width=2048, depth=5, candidates=50):
+        if depth > len(self._SEEDS):
+            raise ValueError(f"depth must be at most {len(self._SEEDS)}")
+        self.width = width
+        self.depth = depth
+        self.capacity = candidates
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self.candidates = {}
+
+    def _rows(self, hashes: np.ndarray):
+        with np.errstate(over="ignore"):
+            for i in range(self.depth):
+                mixed = (hashes ^ self._SEEDS[i]) * _U64(0xBF58476D1CE4E5B9)
+                yield i, ((mixed >> _U64(32)) % _U64(self.width)).astype(np.int64)
+
+    def update(self, values):
+        values = pd.Series(values).dropna()
+        if values.empty:
+            return
+        counts = values.value_counts()
+        hashes = self._hash_keys(counts.index)
+        for i, idx in self._rows(hashes):
+            self.table[i] += np.bincount(idx, weights=counts.to_numpy(), minlength=self.width).astype(np.int64)
+        self.total += int(counts.sum())
+        self._track(counts.index[:self.capacity])
+
+    @staticmethod
+    def _hash_keys(keys) -> np.ndarray:
+        # Always hash as objects so update() and estimate() agree for any key type
+        return hash_values(np.asarray(list(keys), dtype=object))
+
+    def estimate(self, values) -> np.ndarray:
+        hashes = self._hash_keys(values)
+        est = None
+        for i, idx in self._rows(hashes):
+            row = self.table[i, idx]
+            est = row if est is None else np.minimum(est, row)
+        return est if est is not None else np.empty(0, dtype=np.int64)
+
+    def _track(self, new_keys):
+        keys = list(dict.fromkeys(list(self.candidates) + list(new_keys)))
+        if not keys:
+            return
+        est = self.estimate(keys)
+        top = np.argsort(-est, kind="stable")[:self.capacity]
+        self.candidates = {keys[i]: int(est[i]) for i in top}
+
+    def merge(self, other: "CountMinSketch"):
+        self.table += other.table
+        self.total += other.total
+        self._track(list(other.candidates))
+        return self
+
+    def heavy_hitters(self, k=5) -> dict:
+        return dict(list(self.candidates.items())[:k])
@@ -0,0 +1,257 @@
+"""
+Token Accounting for InsightPilot
+(Offline token counts, per-stage prompt budgets and a per-analysis token/cost ledger)
+"""
+
+import contextvars
+import math
+import os
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+try:
+    import tiktoken
+    HAS_TIKTOKEN = True
+except ImportError:
+    HAS_TIKTOKEN = False
+
+# Hard ceiling for any single prompt (gpt-4o has a 128k context; leave room for the answer)
+MAX_PROMPT_TOKENS = int(os.getenv("INSIGHTPILOT_MAX_PROMPT_TOKENS", "120000"))
+# Largest PDF text accepted for map-reduce insights before any call is made
+MAX_PDF_TOKENS = int(os.getenv("INSIGHTPILOT_MAX_PDF_TOKENS", "1000000"))
+
+# Prompt budgets per stage; variable sections are compacted to fit
+STAGE_BUDGETS = {
+    "describe_dataset": int(os.getenv("INSIGHTPILOT_BUDGET_DESCRIBE_TOKENS", "6000")),
+    "report_plan": int(os.getenv("INSIGHTPILOT_BUDGET_REPORT_PLAN_TOKENS", "6000")),
+}
+
+# USD per 1M tokens (input, output)
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+CHARS_PER_TOKEN = 4
+# Per-message overhead of the chat format (role, separators) and reply priming
+_MESSAGE_OVERHEAD = 4
+_REPLY_OVERHEAD = 3
+# Room left for the "[... truncated N tokens ...]" marker
+_MARKER_TOKENS = 12
+
+
+class PromptBudgetError(ValueError):
+    """A prompt or input is too large to send; raised before any network call"""
+
+
+# ---------------------------
+# Counting
+# ---------------------------
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """tiktoken encoding for model, loaded from llama_index's bundled files (no download)"""
+    if not HAS_TIKTOKEN:
+        return None
+    if "TIKTOKEN_CACHE_DIR" not in os.environ:
+        try:
+            import llama_index.core
+            os.environ["TIKTOKEN_CACHE_DIR"] = os.path.join(
+                os.path.dirname(llama_index.core.__file__), "_static", "tiktoken_cache"
+            )
+        except ImportError:
+            pass
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"⚠️ Tokenizer unavailable ({e}); estimating tokens from characters")
+        return None
+
+
+def count_tokens(text: str, model="gpt-4o") -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model="gpt-4o") -> int:
+    return sum(count_tokens(m["content"], model) + _MESSAGE_OVERHEAD for m in messages) + _REPLY_OVERHEAD
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model="gpt-4o") -> str:
+    """
+    Keep the first max_tokens tokens of text, cut back to a line break when one is
+    near, and say how much was dropped. Same input always gives the same output.
+    """
+    total = count_tokens(text, model)
+    if total <= max_tokens:
+        return text
+    encoding = _encoding(model)
+    if encoding is None:
+        head = text[:max(max_tokens, 0) * CHARS_PER_TOKEN]
+    else:
+        head = encoding.decode(encoding.encode(text, disallowed_special=())[:max(max_tokens, 0)])
+    cut = head.rfind("\n")
+    if cut > len(head) // 2:
+        head = head[:cut]
+    return f"{head}\n[... truncated {total - count_tokens(head, model):,} tokens ...]"
+
+
+def fit_sections(template: str, sections: dict, stage: str, model="gpt-4o") -> str:
+    """
+    Fill template (str.format placeholders) with sections, truncating the largest
+    sections first until the prompt fits STAGE_BUDGETS[stage]. Sections that fit
+    are left untouched, so prompts under budget are unchanged.
+    """
+    budget = STAGE_BUDGETS[stage]
+    prompt = template.format(**sections)
+    used = count_tokens(prompt, model)
+    if used <= budget:
+        return prompt
+
+    # Water-fill: every section gets an equal share, and shares unused by small
+    # sections go to the larger ones
+    sizes = {name: count_tokens(text, model) for name, text in sections.items()}
+    available = max(budget - (used - sum(sizes.values())), 0)
+    limits = {}
+    remaining = dict(sizes)
+    while remaining:
+        share = available // len(remaining)
+        small = {name: size for name, size in remaining.items() if size <= share}
+        if not small:
+            limits.update({name: max(share - _MARKER_TOKENS, 0) for name in remaining})
+            break
+        for name, size in small.items():
+            limits[name] = size
+            available -= size
+            del remaining[name]
+
+    fitted = {name: truncate_to_tokens(text, limits[name], model) for name, text in sections.items()}
+    note_compaction(stage, used, budget)
+    return template.format(**fitted)
+
+
+def check_prompt(stage: str, model: str, messages) -> int:
+    """Token count of a chat prompt; raises PromptBudgetError above MAX_PROMPT_TOKENS"""
+    tokens = count_message_tokens(messages, model)
+    if tokens > MAX_PROMPT_TOKENS:
+        raise PromptBudgetError(
+            f"The {stage} prompt needs {tokens:,} tokens, over the {MAX_PROMPT_TOKENS:,} token limit."
+        )
+    return tokens
+
+
+# ---------------------------
+# Ledger
+# ---------------------------
+class TokenLedger:
+    """Token counts and estimated cost of every model call made for one analysis"""
+
+    def __init__(self):
+        self.calls = []
+        self.compactions = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, model: str, prompt_tokens: int, completion_tokens: int, cached=False):
+        with self._lock:
+            self.calls.append({
+                "stage": stage,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cached": cached,
+                "cost": 0.0 if cached else estimate_cost(model, prompt_tokens, completion_tokens),
+            })
+
+    def record_compaction(self, stage: str, used: int, budget: int):
+        with self._lock:
+            self.compactions.append((stage, used, budget))
+
+    def totals(self) -> dict:
+        with self._lock:
+            calls = list(self.calls)
+        costs = [call["cost"] for call in calls if call["cost"] is not None]
+        return {
+            "calls": len(calls),
+            "cached_calls": sum(call["cached"] for call in calls),
+            "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+            "completion_tokens": sum(call["completion_tokens"] for call in calls),
+            "cost": sum(costs),
+            "unpriced_calls": len(calls) - len(costs),
+        }
+
+    def by_stage(self) -> dict:
+        stages = {}
+        with self._lock:
+            calls = list(self.calls)
+        for call in calls:
+            stage = stages.setdefault(call["stage"], {
+                "model": call["model"], "calls": 0, "cached_calls": 0,
+                "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0,
+            })
+            stage["calls"] += 1
+            stage["cached_calls"] += call["cached"]
+            stage["prompt_tokens"] += call["prompt_tokens"]
+            stage["completion_tokens"] += call["completion_tokens"]
+            stage["cost"] = None if stage["cost"] is None or call["cost"] is None else stage["cost"] + call["cost"]
+        return stages
+
+    def summary(self) -> str:
+        lines = []
+        for name, stage in self.by_stage().items():
+            cost = "n/a" if stage["cost"] is None else f"${stage['cost']:.4f}"
+            cached = f", {stage['cached_calls']} cached" if stage["cached_calls"] else ""
+            lines.append(
+                f"- {name} ({stage['model']}, {stage['calls']} call(s){cached}): "
+                f"{stage['prompt_tokens']:,} prompt + {stage['completion_tokens']:,} completion tokens, {cost}"
+            )
+        for stage, used, budget in self.compactions:
+            lines.append(f"- {stage} prompt compacted from {used:,} to the {budget:,} token budget")
+        totals = self.totals()
+        cost = f"${totals['cost']:.4f}"
+        if totals["unpriced_calls"]:
+            cost += f" + {totals['unpriced_calls']} call(s) to models without a known price"
+        lines.append(
+            f"Total: {totals['prompt_tokens']:,} prompt + {totals['completion_tokens']:,} completion tokens, "
+            f"estimated cost {cost} ({totals['cached_calls']} of {totals['calls']} calls served from cache)"
+        )
+        return "\n".join(lines)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int):
+    """Estimated USD cost, or None for models without a known price"""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+_current_ledger = contextvars.ContextVar("insightpilot_token_ledger", default=None)
+
+
+@contextmanager
+def ledger_scope(ledger: TokenLedger):
+    """Record every call made in this context (and tasks/threads copying it) into ledger"""
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+
+
+def record_call(stage: str, model: str, prompt_tokens: int, completion: str, cached=False):
+    ledger = _current_ledger.get()
+    if ledger is not None:
+        ledger.record(stage, model, prompt_tokens, count_tokens(completion or "", model), cached=cached)
+
+
+def note_compaction(stage: str, used: int, budget: int):
+    print(f"✂️ {stage} prompt compacted from {used:,} to {budget:,} tokens")
+    ledger = _current_ledger.get()
+    if ledger is not None:
+        ledger.record_compaction(stage, used, budget)